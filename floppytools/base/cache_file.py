@@ -23,8 +23,8 @@ class CacheFile():
             if not flds or flds[0][0] == '#':
                 continue
 
-            if flds[0] == "file":
-                yield "file", flds[1]
+            if flds[0] in ("file", "timeout"):
+                yield flds[0], flds[1]
                 continue
 
             assert flds[0] == "sector"
@@ -54,3 +54,11 @@ class CacheFile():
     def write_file(self, filename):
         self.cache_file.write("file " + filename + "\n")
         self.cache_file.flush()
+
+    def write_timeout(self, filename):
+        ''' The file ran out of time, what we got from it is above '''
+        self.cache_file.write("timeout " + filename + "\n")
+        self.cache_file.flush()
+
+    def close(self):
+        self.cache_file.close()
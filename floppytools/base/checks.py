@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+'''
+   Checksums and CRCs used by the formats
+   ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+   All of these work on whole sectors at a time, using the
+   C-implemented primitives of bytes, int and itertools,
+   rather than Python loops over the individual bytes.
+'''
+
+import itertools
+import operator
+
+import crcmod
+
+crc16_buypass = crcmod.predefined.mkCrcFun('crc-16-buypass')
+crc16_ccitt_false = crcmod.predefined.mkCrcFun('crc-ccitt-false')
+crc16_xmodem = crcmod.predefined.mkCrcFun('xmodem')
+
+def byte_sum(octets, init=0, width=8):
+    ''' Sum of octets, truncated to width bits '''
+    return (init + sum(octets)) & ((1 << width) - 1)
+
+def xor_sum(octets, init=0):
+    ''' XOR of all octets, by folding the octets as one big integer '''
+    n = len(octets)
+    x = int.from_bytes(octets, 'little')
+    while n > 1:
+        h = (n + 1) // 2
+        x = (x & ((1 << (8 * h)) - 1)) ^ (x >> (8 * h))
+        n = h
+    return x ^ init
+
+def running_xor(octets, init=0):
+    ''' List of the running XOR of the octets '''
+    return list(itertools.accumulate(octets, operator.xor, initial=init))[1:]
+
+def dg_nova_crc(octets):
+    '''
+       The worlds second worst CRC-16 algorithm
+       ========================================
+
+       Meet the worlds second-worst CRC-16 error detection function:
+
+       x16 + x8 +1 aka 0x8080 aka 0x10101
+
+       See page 1, top left corner of:
+       http://bitsavers.org/pdf/dg/disc/4046_4047_4049/4046_4047_schematic.pdf
+
+       This CRC16 has staggeringly bad performance according to Prof. Koopman:
+       0x8080  HD=3  len=8  Example: Len=9 {0} (0x8000) (Bits=2)
+       0x8080  HD=4  NONE  Example: Len=1 {0} (0x8080) (Bits=3)
+
+       For comparison the standarized CCITT CRC16 has:
+       0x8810  HD=3  len=32751  Example: Len=32752 {0} (0x8000) (Bits=2)
+       0x8810  HD=4  len=32751  Example: Len=32752 {0} (0x8000) (Bits=2)
+       0x8810  HD=5  NONE  Example: Len=1 {0} (0x8810) (Bits=4)
+
+       But it is even worse than that, bceause it does not even detect
+       all two-bit errors, both of these inputs gets the result 0x0100:
+
+           0x01 0x00 0x00 0x00
+           0x00 0x00 0x00 0x01
+
+       Because the tap is between the two bytes of the CRC, the function
+       reduces to XOR'ing every third byte into both halves, and the
+       two other thirds into the low and high half respectively.
+    '''
+
+    both = xor_sum(octets[0::3])
+    return (both ^ xor_sum(octets[1::3])) | ((both ^ xor_sum(octets[2::3])) << 8)
+
+# Syndrome tables, per CRC function and message length
+SYNDROMES = {}
+
+# With sector sized messages nearly every CRC-16 syndrome has some two
+# bit solution, so only the most suspect bits are tried.
+MAX_SUSPECTS = 24
+
+def crc_syndromes(crc_func, length):
+    ''' The syndrome of each single bit error in a length octet message '''
+    key = (crc_func, length)
+    table = SYNDROMES.get(key)
+    if table is None:
+        zero = crc_func(bytes(length))
+        nbits = length * 8
+        table = [
+            crc_func((1 << (nbits - 1 - bit)).to_bytes(length, 'big')) ^ zero
+            for bit in range(nbits)
+        ]
+        SYNDROMES[key] = table
+    return table
+
+def crc_repair(crc_func, octets, suspects, prefix=b''):
+    '''
+       Attempt to correct one or two bit errors using the CRC syndrome
+
+       crc_func(prefix + octets) must be zero for a good message.
+       Only the bits listed in suspects, bit zero being the MSB of
+       octets[0], most suspect first, are candidates.
+
+       Returns the repaired octets or None, also if more than one
+       repair would fit.
+    '''
+
+    msg = prefix + octets
+    syndrome = crc_func(msg)
+    if not syndrome:
+        return octets
+    table = crc_syndromes(crc_func, len(msg))
+    skip = len(prefix) * 8
+    suspects = sorted(set(x + skip for x in suspects[:MAX_SUSPECTS]))
+
+    flips = [(bit,) for bit in suspects if table[bit] == syndrome]
+    if not flips:
+        by_syndrome = {}
+        for bit in suspects:
+            by_syndrome.setdefault(table[bit], []).append(bit)
+        for bit in suspects:
+            for other in by_syndrome.get(syndrome ^ table[bit], ()):
+                if other > bit:
+                    flips.append((bit, other))
+    if len(flips) != 1:
+        return None
+    flip = flips[0]
+
+    x = int.from_bytes(msg, 'big')
+    for bit in flip:
+        x ^= 1 << (len(msg) * 8 - 1 - bit)
+    return x.to_bytes(len(msg), 'big')[len(prefix):]
@@ -146,55 +146,115 @@ class Cluster():
         self.b |= other.b
         self.n += other.n
 
+def bitmap_list(bits):
+    ''' The numbers of the set bits, ascending '''
+    retval = []
+    n = 0
+    while bits:
+        if bits & 1:
+            retval.append(n)
+        bits >>= 1
+        n += 1
+    return retval
+
 class CHSSet():
-    ''' Summarize sets of CHS values '''
+    '''
+       Summarize sets of CHS values
+
+       The sectors are kept as a bitmap per track and payload, so
+       that the work is per track, rather than per sector.
+    '''
 
     def __init__(self):
-        self.chs = []
+        # (c, h) -> {payload: bitmap of sectors}
+        self.tracks = {}
+        self.count = 0
         self.clusters = None
 
     def add(self, chs, payload=0):
         ''' add an entry in CHS format '''
         if payload is None:
             payload = 0
-        self.chs.append((*chs, payload))
+        c, h, s = chs[:3]
+        trk = self.tracks.get((c, h))
+        if trk is None:
+            trk = {}
+            self.tracks[(c, h)] = trk
+        trk[payload] = trk.get(payload, 0) | (1 << s)
+        self.count += 1
         self.clusters = None
 
     def __len__(self):
-        return len(self.chs)
+        return self.count
 
     def cylinders(self):
         ''' Summarize just the cylinders '''
-        cyls = set(chs[0] for chs in self.chs)
+        cyls = set(c for c, h in self.tracks)
         return "c" + summarize_ints(cyls)
 
+    def track_runs(self, c, h):
+        ''' Clusters of the runs of sectors with the same payload on a track '''
+        trk = self.tracks[(c, h)]
+        if len(trk) == 1:
+            for b, bits in trk.items():
+                yield c, h, bitmap_list(bits), b
+            return
+        run = []
+        payload = None
+        for sec in bitmap_list(self.track_bits(trk)):
+            for b in sorted(trk):
+                if not trk[b] & (1 << sec):
+                    continue
+                if run and b != payload:
+                    yield c, h, run, payload
+                    run = []
+                payload = b
+                run.append(sec)
+        if run:
+            yield c, h, run, payload
+
+    def track_bits(self, trk):
+        ''' All sectors on a track '''
+        bits = 0
+        for i in trk.values():
+            bits |= i
+        return bits
+
     def cluster(self):
         ''' Cluster the geometry into clusters of like tracks '''
 
         if self.clusters:
             return self.clusters
 
-        wl = list(Cluster(x) for x in sorted(self.chs))
-        for pivot in (2, 1, 0):
-            i = 0
-            while i < len(wl) - 1:
-                if wl[i].same(wl[i+1], pivot):
-                    wl[i].merge(wl[i+1])
-                    wl.pop(i+1)
+        wl = []
+        for c, h in sorted(self.tracks):
+            for c, h, sectors, b in self.track_runs(c, h):
+                cl = Cluster()
+                cl.c.add(c)
+                cl.h.add(h)
+                cl.s.update(sectors)
+                cl.b.add(b)
+                cl.n = len(sectors)
+                wl.append(cl)
+        for pivot in (1, 0):
+            merged = []
+            for cl in wl:
+                if merged and merged[-1].same(cl, pivot):
+                    merged[-1].merge(cl)
                 else:
-                    i += 1
+                    merged.append(cl)
+            wl = merged
         self.clusters = wl
         return self.clusters
 
     def cuboids(self):
         ''' Cluster the geometry into likely cuboids '''
-        cl = list(self.cluster())
-        i = 0
-        while i < len(cl) - 1:
-            if cl[i].b != cl[i+1].b:
-                i += 1
+        cl = []
+        for i in self.cluster():
+            if cl and cl[-1].b == i.b:
+                cl[-1].merge(i)
             else:
-                cl[i].merge(cl.pop(i+1))
+                cl.append(i)
         yield from cl
 
     def seq(self):
@@ -205,30 +265,24 @@ class CHSSet():
     def __iter__(self):
 
         wl = []
-        for c, h, s, p in sorted(self.chs):
-            if wl:
-                prev = wl[-1]
-                if len(prev[0]) == 1 and c in prev[0] and len(prev[1]) == 1 and h in prev[1]:
-                    prev[2].add(s)
-                    prev[3].add(p)
-                    continue
-            wl.append([set((c,)), set((h,)), set((s,)), set((p,))])
-        i = 0
-        while i < len(wl) -1:
-            if wl[i][0] == wl[i+1][0] and wl[i][2] == wl[i+1][2]:
-                wl[i][1] |= wl[i+1][1]
-                wl.pop(i+1)
+        for (c, h), trk in sorted(self.tracks.items()):
+            s = frozenset(bitmap_list(self.track_bits(trk)))
+            if wl and wl[-1][0] == set((c,)) and wl[-1][2] == s:
+                wl[-1][1].add(h)
+                continue
+            wl.append([set((c,)), set((h,)), s, set(trk)])
+
+        # Fold cylinders with the same heads and sectors into the first
+        groups = {}
+        for c, h, s, p in wl:
+            key = (frozenset(h), s)
+            i = groups.get(key)
+            if i is None:
+                groups[key] = [c, h, s, p]
             else:
-                i += 1
-        while wl:
-            c, h, s, p = wl.pop(0)
-            i = 0
-            while i < len(wl):
-                if wl[i][1] == h and wl[i][2] == s:
-                    c |= wl[i][0]
-                    wl.pop(i)
-                else:
-                    i += 1
+                i[0] |= c
+
+        for c, h, s, p in groups.values():
             c = summarize_ints(c)
             h = summarize_ints(h)
             s = summarize_ints(s)
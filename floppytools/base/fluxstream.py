@@ -5,6 +5,10 @@
    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
 '''
 
+import bisect
+import re
+import time
+
 def fm_gap(length):
     ''' Return a '0*length+1' FM gap string '''
     return '|---' * length + '|-|-'
@@ -29,20 +33,32 @@ def make_mark_fm(*args, **kwargs):
     ''' Interleave clock and data bits with FM modulation '''
     return make_mark(*args, **kwargs, pad="-")
 
+FLUX_BITS = str.maketrans('|-', '10')
+
+# Flux transitions between checks of the time budget in the decoding loops
+BUDGET_INTERVAL = 1024
+
 def flux_data(flux, start=1, stride=1):
     ''' extract data bits every start + N * stride '''
-    i = []
-    for j in range(start, len(flux), stride):
-        i.append(flux[j])
-    i = ''.join(i)
-    i = i.replace('|', '1')
-    i = i.replace('-', '0')
+    i = flux[start::stride]
     if ' ' in i:
         return None
-    j = []
-    for k in range(0, len(i), 8):
-        j.append(int(i[k:k+8], 2))
-    return bytes(j)
+    i = i.translate(FLUX_BITS)
+    n = len(i) & ~7
+    j = int(i[:n] or '0', 2).to_bytes(n // 8, 'big')
+    if n < len(i):
+        j += bytes([int(i[n:], 2)])
+    return j
+
+def fuse_flux(windows):
+    '''
+       Per cell majority of flux strings
+
+       The windows must be aligned, typically on a sync mark, and
+       the result is as long as the shortest.
+    '''
+    n = len(windows)
+    return ''.join('|' if x.count('|') * 2 > n else '-' for x in zip(*windows))
 
 class ClockRecovery():
     ''' Configurable adaptive Clock/Data separator '''
@@ -53,13 +69,32 @@ class ClockRecovery():
     # Half a period on traditional 8" floppies
     LIMIT = 12.5
 
+    # Record intervals closer than this to the midpoint between two
+    # thresholds, as a fraction of the distance to the nearest.
+    MARGINAL = .25
+
     SPEC = {
         50: "-|",
         100: "---|",
     }
 
-    def process(self, iterator):
-        ''' Generate flux-string '''
+    # Intervals between checkpoints of the state
+    CHECKPOINT = 256
+
+    def process(self, iterator, margins=None, checkpoints=None, thresholds=None, budget=None):
+        '''
+           Generate flux-string
+
+           If margins is a list, (position, confidence) is appended for
+           every transition where the choice of interval was in doubt.
+
+           If checkpoints is a list, (position, interval number, thresholds)
+           is appended every CHECKPOINT intervals, so the clock recovery
+           can be resumed there with the thresholds argument.
+
+           If budget is given, it is called every BUDGET_INTERVAL
+           intervals, and may raise OutOfTime.
+        '''
         b = []
 
         # Half the interval works best
@@ -71,19 +106,43 @@ class ClockRecovery():
         th = [list(sorted(self.SPEC.keys()))] * len(self.SPEC)
         tokens = [y for x,y in sorted(self.SPEC.items())]
         thr = th[0]
+        if thresholds is not None:
+            thr = list(thresholds)
         b = []
-        for n, i in enumerate(iterator):
+        track = margins is not None or checkpoints is not None
+        pos = -1
+        for dtn, i in enumerate(iterator):
+            if checkpoints is not None and not dtn % self.CHECKPOINT:
+                checkpoints.append((pos + 1, dtn, tuple(thr)))
+            if budget is not None and not dtn % BUDGET_INTERVAL:
+                budget()
             j = [(i - x)**2 for x in thr]
             lo = min(j)
             for n, x in enumerate(thr):
                 if j[n] != lo:
                     continue
                 b.append(tokens[n])
+                if track:
+                    pos += len(tokens[n])
+                if margins is not None:
+                    self.margin(margins, pos, j, n)
                 if j[n] < limit:
                     thr[n] += (i - thr[n]) * rate
                 break
         return ''.join(b)
 
+    def margin(self, margins, pos, j, n):
+        ''' Record the transition at pos if it was a close call '''
+        if len(j) < 2:
+            return
+        near = j[n]**.5
+        other = min(x for m, x in enumerate(j) if m != n)**.5
+        if near + other == 0:
+            return
+        conf = (other - near) / (other + near)
+        if conf < self.MARGINAL:
+            margins.append((pos, conf))
+
 class ClockRecoveryFM(ClockRecovery):
     ''' Classic FM '''
 
@@ -114,15 +173,31 @@ class ClockRecoveryM2FM(ClockRecovery):
             5*rate//2: "----|",
         }
 
+CLOCK_RECOVERY = {
+    "fm": ClockRecoveryFM,
+    "mfm": ClockRecoveryMFM,
+    "m2fm": ClockRecoveryM2FM,
+}
+
+class OutOfTime(Exception):
+    ''' The CPU time budget for decoding this stream ran out '''
+
 class FluxStream():
     ''' ... '''
 
+    # time.thread_time() when the time budget runs out
+    deadline = None
+
 
     def __init__(self):
         self.config_histogram()
         self.fm_cache = {}
         self.mfm_cache = {}
         self.m2fm_cache = {}
+        self.recovered_cache = {}
+        self.margin_cache = {}
+        self.checkpoint_cache = {}
+        self.dt_cache = None
 
     def serialize(self):
         return "-"
@@ -138,21 +213,119 @@ class FluxStream():
     def fm_flux(self, rate=50):
         ''' Return FM flux string '''
         if rate not in self.fm_cache:
-            self.fm_cache[rate] = ClockRecoveryFM(rate).process(self.iter_dt())
+            self.fm_cache[rate] = self.run_recovery("fm", rate)
         return self.fm_cache[rate]
 
     def mfm_flux(self, rate=50):
         ''' Return MFM flux string '''
         if rate not in self.mfm_cache:
-            self.mfm_cache[rate] = ClockRecoveryMFM(rate).process(self.iter_dt())
+            self.mfm_cache[rate] = self.run_recovery("mfm", rate)
         return self.mfm_cache[rate]
 
     def m2fm_flux(self, rate=50):
         ''' Return M2FM flux string '''
         if rate not in self.m2fm_cache:
-            self.m2fm_cache[rate] = ClockRecoveryM2FM(rate).process(self.iter_dt())
+            self.m2fm_cache[rate] = self.run_recovery("m2fm", rate)
         return self.m2fm_cache[rate]
 
+    def run_recovery(self, kind, rate):
+        ''' Run the clock recovery, keeping the checkpoints '''
+        checkpoints = []
+        retval = CLOCK_RECOVERY[kind](rate).process(
+            self.iter_dt(),
+            checkpoints=checkpoints,
+            budget=self.check_budget,
+        )
+        self.checkpoint_cache[(kind, rate)] = checkpoints
+        return retval
+
+    def dt_list(self):
+        ''' All the intervals, as a list '''
+        if self.dt_cache is None:
+            self.dt_cache = list(self.iter_dt())
+        return self.dt_cache
+
+    def reflux(self, kind, rate, start, end, pll_rate, pll_limit):
+        '''
+           Run the {kind}_flux(rate) clock recovery again, but only from
+           the last checkpoint before start, until at least end, and with
+           other RATE and LIMIT parameters.
+
+           Returns (position, flux) where position is where in the
+           original flux string the new flux string starts.
+        '''
+        checkpoints = self.checkpoint_cache.get((kind, rate))
+        if not checkpoints:
+            return 0, ""
+        i = bisect.bisect_right([x[0] for x in checkpoints], start) - 1
+        pos, dtn, thresholds = checkpoints[max(i, 0)]
+        recovery = CLOCK_RECOVERY[kind](rate)
+        recovery.RATE = pll_rate
+        recovery.LIMIT = pll_limit
+        # Every interval is at least two cells
+        dts = self.dt_list()[dtn:dtn + (end - pos) // 2 + 1]
+        return pos, recovery.process(dts, thresholds=thresholds, budget=self.check_budget)
+
+    def recovered_flux(self, recovery):
+        ''' Return flux string from any ClockRecovery, cached by its SPEC '''
+        key = (recovery.__class__, tuple(sorted(recovery.SPEC.items())))
+        if key not in self.recovered_cache:
+            self.recovered_cache[key] = recovery.process(self.iter_dt(), budget=self.check_budget)
+        return self.recovered_cache[key]
+
+    def flux_margins(self, kind, rate=50):
+        '''
+           Where was the clock recovery for {kind}_flux(rate) in doubt ?
+
+           Returns a list of (position, confidence), sorted by position.
+           The clock recovery is run again, but only when asked, which
+           is normally only when trying to repair a sector.
+        '''
+        key = (kind, rate)
+        if key not in self.margin_cache:
+            recovery = CLOCK_RECOVERY[kind](rate)
+            margins = []
+            recovery.process(self.iter_dt(), margins, budget=self.check_budget)
+            self.margin_cache[key] = margins
+        return self.margin_cache[key]
+
+    def suspect_bits(self, kind, rate, start, first, stride, nbits):
+        '''
+           Data bits which may be wrong, most suspect first
+
+           The data bits are those flux_data(flux[start:], first, stride)
+           returns, bit number zero is the MSB of the first octet.
+        '''
+        margins = self.flux_margins(kind, rate)
+        i = bisect.bisect_left(margins, (start, -1))
+        end = start + first + nbits * stride
+        retval = []
+        while i < len(margins) and margins[i][0] < end:
+            pos, conf = margins[i]
+            i += 1
+            for bit in range((pos - start - first) // stride, (pos - start - first) // stride + 2):
+                if 0 <= bit < nbits and abs(start + first + bit * stride - pos) <= stride // 2:
+                    retval.append((conf, bit))
+        seen = set()
+        bits = []
+        for conf, bit in sorted(retval):
+            if bit not in seen:
+                seen.add(bit)
+                bits.append(bit)
+        return bits
+
+    def index_dt(self):
+        ''' Number of the first interval after each index pulse '''
+        return []
+
+    def index_positions(self, flux):
+        ''' Positions of the index pulses in a flux string from this stream '''
+        idx = self.index_dt()
+        if not idx:
+            return []
+        ends = [x.end() for x in re.finditer('[|]', flux)]
+        return [ends[n] for n in idx if n < len(ends)]
+
     def flux_data_fm(self, flux):
         ''' Convert FM flux-string to data '''
         return flux_data(flux, 2, 4)
@@ -161,12 +334,18 @@ class FluxStream():
         ''' Convert MFM flux-string to data '''
         return flux_data(flux, 1, 2)
 
+    def check_budget(self):
+        ''' Raise OutOfTime if the time budget ran out '''
+        if self.deadline is not None and time.thread_time() > self.deadline:
+            raise OutOfTime(str(self))
+
     def iter_pattern(self, fm, gaplen=128, minlen=128, pattern=None):
         ''' Iterate through all gaps in fm-string '''
         off = 0
         if pattern is None:
             pattern = '--' * gaplen + "##"
         while True:
+            self.check_budget()
             nxt = fm.find(pattern, off)
             if nxt < 0 or len(fm) - nxt < minlen:
                 return
@@ -5,15 +5,12 @@
    ---------------------------------
 '''
 
+import bisect
 import struct
 import math
 
-import crcmod
-
 from . import fluxstream
 
-crc16_func = crcmod.predefined.mkCrcFun('crc-16-buypass')
-
 #sck=24027428.5714285
 #ick=3003428.5714285625
 
@@ -71,6 +68,12 @@ class KryoStream(fluxstream.FluxStream):
             samp = self.strm.get(idx[3])
             yield samp - idx[4]
 
+    def index_dt(self):
+        if not self.flux:
+            self.deframe()
+        strms = list(self.strm)
+        return [bisect.bisect_left(strms, idx[3]) for idx in self.index]
+
     def handle_oob(self, _strm, oob):
         if oob[1] == 2:
             i = struct.unpack("<BBHLLL", oob)
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+'''
+   Rotational layout of sectors on a track
+   ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+   The rel_pos of good readings from the same stream can be compared,
+   and from those we learn the sector pitch, the length of a revolution
+   and which slot around the track each sector occupies (= the
+   interleave), relative to the first sector of the track.
+
+   Given the good sectors found in a new stream, that lets us predict
+   where the missing ones should be, so a format can look for them in
+   a small window instead of giving up.
+'''
+
+from collections import Counter
+
+def median(lst):
+    ''' Median of a list of numbers '''
+    lst = sorted(lst)
+    return lst[len(lst) // 2]
+
+class TrackLayout():
+    ''' What we know about the layout of one track '''
+
+    def __init__(self):
+        self.sources = {}
+        self.learned = None
+
+    def add(self, source, rel_pos, sector):
+        ''' Add a good reading '''
+        i = self.sources.get(source)
+        if i is None:
+            i = []
+            self.sources[source] = i
+        i.append((rel_pos, sector))
+        self.learned = None
+
+    def learn(self):
+        '''
+           Return (pitch, revolution, nslots, slots) or None if we do not know enough
+
+           slots maps sector number to the slot around the track,
+           counted from the slot of the lowest sector number.
+        '''
+
+        if self.learned is not None:
+            return self.learned or None
+        self.learned = False
+
+        diffs = []
+        revs = []
+        for readings in self.sources.values():
+            readings.sort()
+            for (p0, s0), (p1, s1) in zip(readings, readings[1:]):
+                if s0 != s1 and p1 > p0:
+                    diffs.append(p1 - p0)
+            last = {}
+            for pos, sec in readings:
+                if sec in last and pos > last[sec]:
+                    revs.append(pos - last[sec])
+                last[sec] = pos
+        if not diffs or not revs:
+            return None
+        rev = median(revs)
+        nslots = round(rev / median(diffs))
+        if nslots < 2:
+            return None
+        pitch = rev / nslots
+
+        votes = {}
+        for readings in self.sources.values():
+            first = min(readings, key=lambda x: (x[1], x[0]))
+            for pos, sec in readings:
+                slot = round(((pos - first[0]) % rev) / pitch) % nslots
+                if sec not in votes:
+                    votes[sec] = Counter()
+                votes[sec][(slot, first[1])] += 1
+
+        # Only trust slots relative to the overall lowest sector
+        lowest = min(votes)
+        slots = {}
+        for sec, cnt in votes.items():
+            for (slot, ref), _n in cnt.most_common():
+                if ref == lowest:
+                    slots[sec] = slot
+                    break
+        if len(slots) < 2:
+            return None
+        self.learned = (pitch, rev, nslots, slots)
+        return self.learned
+
+    def predict(self, anchors, limit):
+        '''
+           Predict where sectors not in anchors should be
+
+           anchors is a list of (rel_pos, sector) of good sectors in
+           the current stream, yields (rel_pos, sector, slack) for
+           each predicted position in [0, limit) which has no anchor.
+        '''
+
+        learned = self.learn()
+        if not learned:
+            return
+        pitch, rev, nslots, slots = learned
+
+        anchors = [x for x in anchors if x[1] in slots]
+        if not anchors:
+            return
+
+        estimates = []
+        for apos, asec in anchors:
+            for sec, slot in slots.items():
+                dist = ((slot - slots[asec]) % nslots) * pitch
+                for pos in (apos + dist, apos + dist - rev):
+                    if 0 <= pos < limit:
+                        estimates.append((sec, pos, abs(pos - apos)))
+
+        # Use the estimate from the nearest anchor for each occurrence
+        best = []
+        for sec, pos, dist in sorted(estimates):
+            if best and best[-1][0] == sec and pos - best[-1][1] < pitch / 2:
+                if dist < best[-1][2]:
+                    best[-1] = (sec, pos, dist)
+                continue
+            best.append((sec, pos, dist))
+
+        for sec, pos, _dist in best:
+            if any(abs(pos - x[0]) < pitch / 2 for x in anchors):
+                continue
+            yield round(pos), sec, round(pitch / 8)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+'''
+   Trace and log files
+   ~~~~~~~~~~~~~~~~~~~
+
+   All log files are written by a single background thread, so
+   tracing does not wait for the disk, and lines for the same
+   file are written together.
+
+   A file is opened once, however many media trace to it, and
+   closed when the last of them is done with it.  When a file
+   grows beyond MAX_SIZE it is renamed to .1, .2 … and a new
+   file is started.
+
+   A file which cannot be written is reported once on stderr, and
+   what was to be written to it is lost, but the writer carries on.
+'''
+
+import os
+import sys
+import queue
+import threading
+import atexit
+
+# Rotate log files larger than this
+MAX_SIZE = 64 << 20
+
+# Number of rotated log files to keep
+KEEP = 3
+
+class LogManager():
+    ''' The log files and the thread which writes them '''
+
+    def __init__(self, max_size=MAX_SIZE, keep=KEEP):
+        self.max_size = max_size
+        self.keep = keep
+        self.users = {}
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+        # Only used by the writer thread
+        self.handles = {}
+        # filename -> the error, of files which could not be written
+        self.errors = {}
+
+    def open(self, filename):
+        ''' Start using a log file '''
+        with self.lock:
+            self.users[filename] = self.users.get(filename, 0) + 1
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.writer,
+                    name="LogManager",
+                    daemon=True,
+                )
+                self.thread.start()
+        return filename
+
+    def close(self, filename):
+        ''' Stop using a log file '''
+        with self.lock:
+            n = self.users.get(filename, 0) - 1
+            if n > 0:
+                self.users[filename] = n
+                return
+            self.users.pop(filename, None)
+        self.queue.put((filename, None))
+
+    def write(self, filename, txt):
+        ''' Queue txt for writing to filename '''
+        self.queue.put((filename, txt))
+
+    def flush(self):
+        ''' Wait until everything queued so far is written '''
+        if self.thread is not None:
+            self.queue.join()
+
+    def shutdown(self):
+        ''' Write everything and stop the writer thread '''
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def writer(self):
+        ''' The writer thread '''
+        while True:
+            batch = [self.queue.get()]
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = True
+            try:
+                stop = self.write_batch(batch)
+            finally:
+                for _i in batch:
+                    self.queue.task_done()
+            if stop:
+                return
+
+    def write_batch(self, batch):
+        ''' Write a batch of lines, in order, one write per file '''
+        pending = {}
+        stop = False
+        for item in batch:
+            if item is None:
+                stop = True
+                break
+            filename, txt = item
+            if txt is not None:
+                pending.setdefault(filename, []).append(txt)
+                continue
+            self.write_file(filename, pending.pop(filename, []))
+            self.close_file(filename)
+        for filename, lines in pending.items():
+            self.write_file(filename, lines)
+        if stop:
+            for filename in list(self.handles):
+                self.close_file(filename)
+        return stop
+
+    def close_file(self, filename):
+        ''' Close our handle on a file, if we have one '''
+        fd = self.handles.pop(filename, None)
+        if fd is None:
+            return
+        try:
+            fd.close()
+        except OSError as err:
+            self.failed(filename, err)
+
+    def failed(self, filename, err):
+        ''' Report a file which cannot be written, the first time '''
+        if filename not in self.errors:
+            self.errors[filename] = err
+            sys.stderr.write("Cannot write log file %s: %s\n" % (filename, err))
+
+    def write_file(self, filename, lines):
+        ''' Write lines to a file, rotating it if it gets too big '''
+        if not lines:
+            return
+        try:
+            fd = self.handles.get(filename)
+            if fd is None:
+                fd = open(filename, "a", encoding="utf8")
+                self.handles[filename] = fd
+            fd.write("".join(lines))
+            fd.flush()
+            if fd.tell() > self.max_size:
+                self.close_file(filename)
+                self.rotate(filename)
+        except OSError as err:
+            self.failed(filename, err)
+            self.close_file(filename)
+
+    def rotate(self, filename):
+        ''' Rename filename to filename.1, filename.1 to filename.2 … '''
+        for i in range(self.keep - 1, 0, -1):
+            src = filename + ".%d" % i
+            if os.path.exists(src):
+                os.replace(src, filename + ".%d" % (i + 1))
+        if self.keep:
+            os.replace(filename, filename + ".1")
+        else:
+            os.remove(filename)
+
+LOG = LogManager()
+atexit.register(LOG.shutdown)
@@ -11,8 +11,32 @@ import time
 
 from . import media_abc
 from . import kryostream
+from . import fluxstream
 from . import chsset
 from . import cache_file
+from . import checks
+from . import log
+
+# Sectors a format without an expected geometry counts as missing, when probing
+UNKNOWN_MISSING = 2
+
+# Per media directory, which format decoded it
+MARKER_FILE = "_.ft.format"
+
+def read_marker(dirname):
+    ''' The (format name, version, file) which decoded dirname, if any '''
+    try:
+        with open(os.path.join(dirname, MARKER_FILE), encoding="utf8") as file:
+            # The file name is last, and may contain spaces
+            flds = file.read().rstrip("\n").split(maxsplit=3)
+        if len(flds) != 4 or flds[0] != "format":
+            return None
+        return flds[1], int(flds[2]), flds[3]
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        # Corrupt or truncated, probe as if there were no marker
+        return None
 
 class Media(media_abc.MediaAbc):
     ''' A Directory representing a Media '''
@@ -26,25 +50,101 @@ class Media(media_abc.MediaAbc):
     # Other names or groups this format belongs to.
     aliases = [ ]
 
-    def __init__(self, dirname, load_cache=False, save_cache=False):
+    # Large trace dumps, such as flux, per track
+    DUMPS_PER_TRACK = 3
+
+    # CPU seconds this format may spend on one stream file, unless
+    # overridden with the time_budget argument
+    TIME_BUDGET = 60
+
+    # Bump when the decoding changes, markers of other versions are ignored
+    VERSION = 1
+
+    def __init__(
+        self,
+        dirname,
+        load_cache=False,
+        save_cache=False,
+        repair=False,
+        trace_level=1,
+        time_budget=None,
+    ):
         super().__init__()
         self.dirname = dirname
-        os.makedirs(self.dirname, exist_ok=True)
-        self.medianame = os.path.basename(self.dirname)
+        self.repair = repair
+        self.trace_level = trace_level
+        self.time_budget = time_budget
+        self.timeouts = set()
+        self.dumps = {}
         self.files_done = set()
-        self.log_files = [
-            (True, open("_.trace", "a")),
-            (False, open(self.file_name(".trace"), "a")),
-        ]
+        self.log_files = []
+        if self.dirname is None:
+            # Probing, see probe(), touch no files
+            self.medianame = None
+        else:
+            os.makedirs(self.dirname, exist_ok=True)
+            self.medianame = os.path.basename(self.dirname)
+            self.log_files = [
+                (True, log.LOG.open("_.trace")),
+                (False, log.LOG.open(self.file_name(".trace"))),
+            ]
         # print("DEFGEOM", type(self), self.GEOMETRY)
         if self.GEOMETRY is not None:
             self.define_geometry(*self.GEOMETRY)
 
         self.cache_file = None
+        self.save_marker = save_cache
         if load_cache:
             self.read_cache()
         if save_cache:
             self.cache_file = cache_file.CacheFile(self.cache_file_name(), "a")
+            self.subscribe(self.cache_event)
+
+    @classmethod
+    def probe(cls, stream, time_budget=None):
+        '''
+           How confident are we that stream is in this format, 0…1
+
+           The stream is decoded by a throw-away instance which has
+           no directory, cache or trace files, so all formats can be
+           probed with the same stream, reusing its flux strings.
+
+           The confidence is the fraction of the expected sectors, on
+           the tracks where any were found, which decoded.  Formats
+           which do not know what to expect count as missing
+           UNKNOWN_MISSING sectors, so they lose to a format which
+           found as many sectors and knew to expect them.
+        '''
+        media = cls(None)
+        stream.deadline = cls.stream_deadline(time_budget)
+        try:
+            if not media.process_stream(stream):
+                return 0
+        except fluxstream.OutOfTime:
+            return 0
+        good = set()
+        for chs, ms in media.sectors.items():
+            if ms.nreadings and ms.find_majority() is not None:
+                good.add(chs)
+        if not good:
+            return 0
+        tracks = set(x[:2] for x in good)
+        expected = set(
+            chs for chs, ms in media.sectors.items()
+            if chs[:2] in tracks and ms.has_flag('defined')
+        )
+        if not expected:
+            return len(good) / (len(good) + UNKNOWN_MISSING)
+        return len(good) / len(good | expected)
+
+    @classmethod
+    def stream_deadline(cls, time_budget=None):
+        ''' The stream.deadline for a time budget, default TIME_BUDGET '''
+        if time_budget is None:
+            time_budget = cls.TIME_BUDGET
+        if time_budget is None:
+            return None
+        return time.thread_time() + time_budget
 
     def define_geometry(self, first_chs, last_chs, sector_size):
         ''' Define which sectors we expect to find '''
@@ -79,55 +179,127 @@ class Media(media_abc.MediaAbc):
         txt = super().message(*args)
         self.trace(txt)
 
-    def trace(self, *args):
-        txt = " ".join(str(x) for x in args)
+    def trace(self, *args, level=1):
+        '''
+           Write a line to the trace files
+
+           Callable arguments are called to get the value to trace,
+           so expensive formatting can be skipped at lower levels.
+        '''
+        if level > self.trace_level:
+            return
+        txt = " ".join(str(x() if callable(x) else x) for x in args) + "\n"
         for pfx, fn in self.log_files:
             if pfx:
-                fn.write(self.dirname + ": ")
-            fn.write(txt + "\n")
-            fn.flush()
+                log.LOG.write(fn, self.dirname + ": " + txt)
+            else:
+                log.LOG.write(fn, txt)
+
+    def close(self):
+        ''' Release the log and cache files '''
+        for _pfx, fn in self.log_files:
+            log.LOG.close(fn)
+        self.log_files = []
+        if self.cache_file:
+            self.cache_file.close()
+            self.cache_file = None
+
+    def trace_dump(self, track, *args, level=1):
+        ''' Trace large dumps, but only the first DUMPS_PER_TRACK per track '''
+        if level > self.trace_level:
+            return
+        n = self.dumps.get(track, 0) + 1
+        self.dumps[track] = n
+        if n <= self.DUMPS_PER_TRACK:
+            self.trace(*args, level=level)
+        elif n == self.DUMPS_PER_TRACK + 1:
+            self.trace("DUMPS", track, "more dumps suppressed", level=level)
 
     def did_read_sector(self, source, rel_pos, am_chs, octets, flags=()):
         rs = media_abc.ReadSector(source, rel_pos, am_chs, octets, flags)
         self.add_read_sector(rs)
         return rs
 
-    def add_read_sector(self, read_sector):
-        ''' Add a reading of a sector '''
-        super().add_read_sector(read_sector)
-        if not self.cache_file:
-            return
-        self.cache_file.write_sector(read_sector)
+    def repair_sector(self, crc_func, octets, suspects, prefix=b''):
+        '''
+           Try to repair a sector which failed its CRC
 
-    def process_file(self, streamfilename):
-        ''' ... '''
+           Returns the repaired octets or None.
+           The caller must flag the reading "repaired".
+        '''
+        if not self.repair:
+            return None
+        retval = checks.crc_repair(crc_func, octets, suspects, prefix)
+        if retval is not None:
+            self.trace("REPAIRED", len(suspects), hex(crc_func(prefix + octets)))
+        return retval
+
+    def cache_event(self, _media, event, arg):
+        ''' Write new readings to the cache file '''
+        if event == media_abc.EVENT_SECTOR and self.cache_file:
+            self.cache_file.write_sector(arg)
+
+    def process_file(self, streamfilename, stream=None):
+        '''
+           Process a stream file, which may already have been probed
+
+           Returns True if this format found anything in the file,
+           False if not, and None if the file was already done, is
+           ignored by this format, or ran out of time, since that does
+           not tell if this is the right format.
+        '''
 
         rel_filename = os.path.relpath(streamfilename, self.dirname)
         if rel_filename in self.files_done:
             self.trace("File already done", streamfilename, rel_filename)
-            return False
+            return None
         self.trace("Process", streamfilename, rel_filename)
         #try:
-        if 1:
+        if stream is None:
             stream = kryostream.KryoStream(streamfilename)
         #except kryostream.NotAKryofluxStream:
             #stream = fluxstream.RawStream(streamfilename)
-        retval = self.process_stream(stream)
+        stream.deadline = self.stream_deadline(self.time_budget)
+        try:
+            retval = self.process_stream(stream)
+        except fluxstream.OutOfTime:
+            # Keep what we got, but do not try this file again
+            self.trace("Timeout", streamfilename)
+            self.timeouts.add(rel_filename)
+            self.files_done.add(rel_filename)
+            if self.cache_file:
+                self.cache_file.write_timeout(rel_filename)
+            return None
         if retval is None:
             self.trace("Ignored", streamfilename)
-            return False
+            return None
         if retval != None:
             for i in stream.dt_histogram():
                 self.trace(i)
         if self.cache_file:
             self.cache_file.write_file(rel_filename)
+        if retval and self.save_marker:
+            self.write_marker(rel_filename)
         return retval
 
+    def write_marker(self, rel_filename):
+        ''' Record that this format decoded this directory, once '''
+        self.save_marker = False
+        marker = read_marker(self.dirname)
+        if marker and marker[:2] == (self.name, self.VERSION):
+            return
+        with open(os.path.join(self.dirname, MARKER_FILE), "w", encoding="utf8") as file:
+            file.write(" ".join(("format", self.name, str(self.VERSION), rel_filename)) + "\n")
+        self.trace("Marker", self.name, self.VERSION, rel_filename)
+
     def read_cache(self):
         try:
              for kind, obj in cache_file.CacheFile(self.cache_file_name(), "r").read():
                  if kind == "file":
                      self.files_done.add(obj)
+                 elif kind == "timeout":
+                     self.files_done.add(obj)
+                     self.timeouts.add(obj)
                  elif kind == "sector":
                      self.add_read_sector(obj)
                  else:
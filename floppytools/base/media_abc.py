@@ -6,11 +6,73 @@
 '''
 
 from .chsset import CHSSet
+from .layout import TrackLayout
 from collections import Counter
 
+# A reading repaired from its CRC counts for less than a clean reading,
+# so a repair on its own can never outvote or settle a sector.
+REPAIRED_WEIGHT = .5
+
+# Likewise a reading found where the track layout predicted a sector,
+# without an address mark to confirm which sector it is.
+PREDICTED_WEIGHT = .5
+
+def flags_weight(flags):
+    ''' The weight of a reading with these flags '''
+    weight = 1
+    if "repaired" in flags:
+        weight *= REPAIRED_WEIGHT
+    if "predicted" in flags:
+        weight *= PREDICTED_WEIGHT
+    return weight
+
+class Interns():
+    '''
+       Per media tables of the sources and flag sets of the readings
+
+       MediaSector keeps its readings as tuples with a source_id and
+       a flags_id, the ids index these tables.  They go away with the
+       media, so a long running process does not accumulate them.
+    '''
+
+    def __init__(self):
+        self.sources = []
+        self.source_ids = {}
+        self.flagsets = []
+        self.flagset_ids = {}
+        self.weights = []
+
+    def source_id(self, source):
+        ''' Intern a source name '''
+        i = self.source_ids.get(source)
+        if i is None:
+            i = len(self.sources)
+            self.sources.append(source)
+            self.source_ids[source] = i
+        return i
+
+    def flagset_id(self, flags):
+        ''' Intern a set of flags '''
+        flags = frozenset(flags)
+        i = self.flagset_ids.get(flags)
+        if i is None:
+            i = len(self.flagsets)
+            self.flagsets.append(flags)
+            self.flagset_ids[flags] = i
+            self.weights.append(flags_weight(flags))
+        return i
+
+# Events published to subscribers, with their argument:
+EVENT_SECTOR = "sector"		# A sector was read: the ReadSector
+EVENT_SETTLED = "settled"	# A sector settled: the MediaSector
+EVENT_TRACK = "track"		# All defined sectors of a track good: (cyl, head)
+EVENT_MEDIA = "media"		# All defined sectors good: None
+
 class ReadSector():
     ''' One reading of a sector '''
 
+    __slots__ = ("rel_pos", "am_chs", "phys_chs", "octets", "source", "good", "flags")
+
     def __init__(self, source, rel_pos, am_chs, octets, flags=(), good=True, phys_chs=None):
         assert len(am_chs) == 3
         if phys_chs is None:
@@ -27,9 +89,9 @@ class ReadSector():
             self.source = str(source)
 
         self.good = good
-        self.flags = set(flags)
         if not good:
-            self.flags.add("bad")
+            flags = set(flags) | set(("bad",))
+        self.flags = frozenset(flags)
 
     def __str__(self):
         return str(("ReadSector", self.phys_chs, self.am_chs, self.good, len(self.octets), self.flags))
@@ -42,21 +104,53 @@ class ReadSector():
 
 class MediaSector():
 
-    ''' What we know about a sector on the media '''
+    '''
+       What we know about a sector on the media
 
-    def __init__(self, am_chs, phys_chs, sector_length=None):
+       The readings are not kept as ReadSector objects, but as
+       a list of (number, source_id, rel_pos, flags_id) per distinct
+       content, in self.values, number being the order of arrival.
+    '''
+
+    __slots__ = (
+        "am_chs",
+        "phys_chs",
+        "values",
+        "nreadings",
+        "weights",
+        "leaders",
+        "distinct",
+        "sector_length",
+        "lengths",
+        "flags",
+        "status_cache",
+        "interns",
+    )
+
+    def __init__(self, am_chs, phys_chs, sector_length=None, interns=None):
         assert am_chs is None or len(am_chs) == 3
         assert len(phys_chs) == 3
         self.am_chs = am_chs
         if am_chs is not None:
             phys_chs = (phys_chs[0], phys_chs[1], am_chs[2])
         self.phys_chs = phys_chs
-        self.readings = []
         self.values = {}
+        self.nreadings = 0
+
+        # The consensus is maintained as readings arrive: the weight
+        # of each distinct content, and per length, and for all lengths
+        # under the key None, the leading content and the number of
+        # distinct contents.
+        self.weights = {}
+        self.leaders = {}
+        self.distinct = {}
         self.sector_length = sector_length
         self.lengths = set()
         self.flags = set()
         self.status_cache = {}
+        if interns is None:
+            interns = Interns()
+        self.interns = interns
 
     def __str__(self):
         return str(("MediaSector", self.phys_chs, self.sector_length, self.flags))
@@ -64,6 +158,27 @@ class MediaSector():
     def __lt__(self, other):
         return self.phys_chs < other.phys_chs
 
+    @property
+    def readings(self):
+        ''' The readings, as ReadSector objects, in the order they arrived '''
+        retval = []
+        for octets, lst in self.values.items():
+            for number, src, rel_pos, flags in lst:
+                flags = self.interns.flagsets[flags]
+                retval.append((
+                    number,
+                    ReadSector(
+                        self.interns.sources[src],
+                        rel_pos,
+                        self.am_chs,
+                        octets,
+                        flags,
+                        good = "bad" not in flags,
+                        phys_chs = self.phys_chs,
+                    )
+                ))
+        return [rs for _number, rs in sorted(retval, key=lambda x: x[0])]
+
     def set_flag(self, flag):
         self.flags.add(flag)
 
@@ -77,12 +192,19 @@ class MediaSector():
             self.am_chs = read_sector.am_chs
         assert read_sector.am_chs == self.am_chs
         assert read_sector.phys_chs == self.phys_chs
-        self.readings.append(read_sector)
         i = self.values.get(read_sector.octets)
         if i is None:
             i = []
             self.values[read_sector.octets] = i
-        i.append(read_sector)
+        flags_id = self.interns.flagset_id(read_sector.flags)
+        i.append((
+            self.nreadings,
+            self.interns.source_id(read_sector.source),
+            read_sector.rel_pos,
+            flags_id,
+        ))
+        self.nreadings += 1
+        self.vote(read_sector.octets, self.interns.weights[flags_id])
         self.lengths.add(len(read_sector.octets))
         if len(self.lengths) == 1:
             self.sector_length = len(read_sector.octets)
@@ -91,26 +213,41 @@ class MediaSector():
         self.flags |= read_sector.flags
         self.status_cache = {}
 
+    def vote(self, octets, weight):
+        ''' Update the consensus with a reading '''
+        new = octets not in self.weights
+        w = self.weights.get(octets, 0) + weight
+        self.weights[octets] = w
+        for key in (len(octets), None):
+            if new:
+                self.distinct[key] = self.distinct.get(key, 0) + 1
+            leader = self.leaders.get(key)
+            if leader is None or w > self.weights[leader]:
+                self.leaders[key] = octets
+
     def find_majority(self):
-        t = self.status_cache.get("majority")
-        if t:
-            return t
-        chosen = None
-        majority = 0
-        count = 0
-        for i, j in self.values.items():
-            if self.sector_length and len(i) != self.sector_length:
-                continue
-            count += 1
-            if len(j) > majority:
-                majority = len(j)
-                chosen = i
-        minority = count - majority
-        retval = None
-        if majority > 2 * minority:
-            retval = chosen
-        self.status_cache["majority"] = retval
-        return retval
+        '''
+           The content with a clear majority of the right length, if any
+
+           The (weighted) readings of the leading content are held
+           against the number of distinct contents, not against the
+           readings of the others, and must weigh at least one.
+        '''
+        key = self.sector_length or None
+        leader = self.leaders.get(key)
+        if leader is None:
+            return None
+        majority = self.weights[leader]
+        if majority > 2 * (self.distinct[key] - majority) and majority >= 1:
+            return leader
+        return None
+
+    def settled(self, readings):
+        ''' Do we have a majority with at least this many readings ? '''
+        maj = self.find_majority()
+        if maj is None:
+            return False
+        return self.weights[maj] >= readings
 
     def real_sector_status(self, vert=False):
         ''' Report status and visual aid '''
@@ -123,16 +260,21 @@ class MediaSector():
         if len(self.values) > 1:
             return False, '╬', None
         if self.sector_length:
+            # There is no majority of the wrong length, report the
+            # length of what was read instead.
             k = list(self.values.keys())[0]
             if len(k) > self.sector_length:
-                return False, '>', len(maj)
+                return False, '>', len(k)
             if len(k) < self.sector_length:
-                return False, '<', len(maj)
+                return False, '<', len(k)
+        if maj is None:
+            # Only a repaired reading
+            return False, 'r', None
         if vert:
             #             01234567
-            return True, "×▏▎▌▋▊▉█"[min(len(self.readings), 7)], len(maj)
+            return True, "×▏▎▌▋▊▉█"[min(self.nreadings, 7)], len(maj)
         else:
-            return True, "×▁▂▃▄▅▆▇█"[min(len(self.readings), 8)], len(maj)
+            return True, "×▁▂▃▄▅▆▇█"[min(self.nreadings, 8)], len(maj)
 
     def sector_status(self, **kwargs):
         ''' Report status and visual aid '''
@@ -150,27 +292,48 @@ class MediaAbc():
        This is the superclass by the actual formats
     '''
 
+    # Identical good readings before we stop decoding a sector
+    SETTLED_READINGS = 3
+
     def __init__(self, name=None):
         if name is None:
             name = self.__class__.__name__
         self.name = name
         self.sectors = {}
+        self.interns = Interns()
         self.cyl_no = set()
         self.hd_no = set()
         self.sec_no = set()
         self.lengths = set()
         self.messages = set()
         self.n_expected = 0
-        self.status_cache = {}
-        self.goodset = set()
+        # Built from self.good when needed, None when out of date
+        self.goodset = None
+        self.goodset_lines = None
         self.weird_ams = 0
 
+        # Sectors whose status may have changed since refresh_status()
+        self.dirty = set()
+        # chs -> payload, of the sectors which are good
+        self.good = {}
+        self.ngood = 0
+        self.nextra = 0
+        self.layouts = {}
+
+        # (cyl, head) -> chs of the sectors on that track
+        self.track_sectors = {}
+        self.subscribers = []
+        self.media_complete = False
+
     def __str__(self):
         return "{MEDIA " + self.__class__.__name__ + " " + self.name + "}"
 
     def __getitem__(self, chs):
         return self.sectors.get(chs)
 
+    def trace(self, *args, level=1):
+        ''' Trace output, see media.Media '''
+
     def message(self, *args):
         txt = " ".join(str(x) for x in args)
         if txt in self.messages:
@@ -178,34 +341,109 @@ class MediaAbc():
         self.messages.add(txt)
         return txt
 
+    def subscribe(self, func):
+        ''' Call func(media, event, arg) for every event '''
+        self.subscribers.append(func)
+
+    def unsubscribe(self, func):
+        ''' Stop calling func '''
+        self.subscribers.remove(func)
+
+    def publish(self, event, arg=None):
+        ''' Call the subscribers '''
+        for func in self.subscribers:
+            func(self, event, arg)
+
+    def new_sector(self, ms):
+        ''' Keep track of a new MediaSector '''
+        self.sectors[ms.phys_chs] = ms
+        self.track_sectors.setdefault(ms.phys_chs[:2], set()).add(ms.phys_chs)
+
+    def track_complete(self, track):
+        ''' Are all the defined sectors of this track good ? '''
+        for chs in self.track_sectors.get(track, ()):
+            ms = self.sectors[chs]
+            if ms.has_flag("defined") and ms.find_majority() is None:
+                return False
+        return True
+
     def get_sector(self, chs):
         assert len(chs) == 3
         ms = self.sectors.get(chs)
         if ms is None:
-            ms = MediaSector(chs)
-            self.sectors[chs] = ms
+            ms = MediaSector(None, chs, interns=self.interns)
+            self.new_sector(ms)
         return ms
 
+    def track_layout(self, track):
+        ''' The TrackLayout of (cylinder, head) '''
+        i = self.layouts.get(track)
+        if i is None:
+            i = TrackLayout()
+            self.layouts[track] = i
+        return i
+
+    def sector_settled(self, chs, stream=None):
+        '''
+           Is this sector settled ?
+
+           Formats use this to skip extracting and checking the data
+           of sectors we already have enough good readings of.
+
+           With a stream, chs is from an address mark, and the sector
+           is looked up by the physical cylinder and head of the stream,
+           as ReadSector does, because the address mark may differ.
+        '''
+        if stream is not None:
+            chs = (stream.chs[0], stream.chs[1], chs[2])
+        ms = self.sectors.get((chs[0], chs[1], chs[2]))
+        if ms is None:
+            return False
+        return ms.settled(self.SETTLED_READINGS)
+
     def add_read_sector(self, rs):
         assert len(rs.am_chs) == 3
         assert len(rs.phys_chs) == 3
         if rs.am_chs != rs.phys_chs:
             self.weird_ams += 1
         if rs.phys_chs not in self.sectors:
-            self.sectors[rs.phys_chs] = MediaSector(rs.am_chs, rs.phys_chs)
-        self.trace("AMS", rs.phys_chs, rs.am_chs, self.sectors[rs.phys_chs])
-        self.sectors[rs.phys_chs].add_read_sector(rs)
+            self.new_sector(MediaSector(rs.am_chs, rs.phys_chs, interns=self.interns))
+        ms = self.sectors[rs.phys_chs]
+        self.trace("AMS", rs.phys_chs, rs.am_chs, ms, level=2)
+        if self.subscribers:
+            was_good = ms.find_majority() is not None
+            was_settled = ms.settled(self.SETTLED_READINGS)
+        ms.add_read_sector(rs)
+        if rs.good and "predicted" not in rs.flags:
+            self.track_layout(rs.phys_chs[:2]).add(rs.source, rs.rel_pos, rs.phys_chs[2])
         self.cyl_no.add(rs.phys_chs[0])
         self.hd_no.add(rs.phys_chs[1])
         self.sec_no.add(rs.phys_chs[2])
         self.lengths.add(len(rs))
-        self.status_cache = {}
+        self.dirty.add(rs.phys_chs)
+        if self.subscribers:
+            self.publish_sector(rs, ms, was_good, was_settled)
+
+    def publish_sector(self, rs, ms, was_good, was_settled):
+        ''' Publish the events a new reading caused '''
+        self.publish(EVENT_SECTOR, rs)
+        if not was_settled and ms.settled(self.SETTLED_READINGS):
+            self.publish(EVENT_SETTLED, ms)
+        if was_good or ms.find_majority() is None or not ms.has_flag("defined"):
+            return
+        track = ms.phys_chs[:2]
+        if self.track_complete(track):
+            self.publish(EVENT_TRACK, track)
+        self.refresh_status()
+        if not self.media_complete and self.n_expected and self.ngood == self.n_expected:
+            self.media_complete = True
+            self.publish(EVENT_MEDIA)
 
     def define_sector(self, chs, sector_length=None):
         ms = self.sectors.get(chs)
         if ms is None:
-            ms = MediaSector(None, chs, sector_length)
-            self.sectors[chs] = ms
+            ms = MediaSector(None, chs, sector_length, self.interns)
+            self.new_sector(ms)
         if not ms.has_flag("defined"):
             ms.sector_length = sector_length
             ms.set_flag("defined")
@@ -219,6 +457,7 @@ class MediaAbc():
         self.cyl_no.add(chs[0])
         self.hd_no.add(chs[1])
         self.sec_no.add(chs[2])
+        self.dirty.add(chs)
         return ms
 
     def picture(self):
@@ -324,69 +563,73 @@ class MediaAbc():
             for x in j:
                 yield i, x
 
-    def summary(self, long=False):
-        retval = self.status_cache.get("summary")
-        if retval is None:
-            ngood = 0
-            nextra = 0
-            badones = {}
-            goodset = CHSSet()
-            badset = CHSSet()
-            l = [ self.name ]
-            for ms in self.sectors.values():
-                i, j, k = self.sector_status(ms)
-                defd = ms.has_flag("defined")
-                if i and defd:
-                    ngood += 1
-                    goodset.add(ms.phys_chs)
-                elif i:
-                    nextra += 1
-                    goodset.add(ms.phys_chs, payload=ms.sector_length)
+    def refresh_status(self):
+        '''
+           Update the good sectors and counters, for the sectors which changed
+
+           The CHSSet of good sectors is only marked out of date, it is
+           rebuilt by good_set() when somebody asks for it.
+        '''
+        if not self.dirty:
+            return
+        changed = False
+        for chs in self.dirty:
+            ms = self.sectors[chs]
+            i, _j, _k = self.sector_status(ms)
+            old = self.good.pop(chs, None)
+            if old is not None:
+                if old:
+                    self.nextra -= 1
                 else:
-                    badset.add(ms.phys_chs)
-                    if j not in badones:
-                        badones[j] = []
-                    badones[j].append(ms)
-            if ngood == 0 and nextra == 0:
-                l.append("NOTHING")
-            elif self.n_expected and ngood == self.n_expected:
-                l.append("COMPLETE")
-                if nextra:
-                    l.append("EXTRA")
-            else:
-                l.append("✓: %d " % len(goodset))
-                if False:
-                    if not self.n_expected and not badones:
-                        l.append("SOMETHING")
-                        l.append("")
-                        for x in goodset:
-                            if len(l[-1]) + len(x) < 64:
-                                l[-1] += "," + x
-                            else:
-                                l[-1] += "[…]"
-                                break
-                        l[-1] = l[-1][1:]
-                    else:
-                        l.append("MISSING")
-                        l.append(badset.cylinders())
-                    for c in sorted(badones):
-                        l.append(c + ": %d" % len(badones[c]))
-            if self.weird_ams:
-                 l.append("AM!%d" % self.weird_ams)
-            retval = "  ".join(l)
-            self.goodset = goodset
-            self.status_cache["summary"] = retval
+                    self.ngood -= 1
+            new = None
+            if i and ms.has_flag("defined"):
+                new = 0
+                self.ngood += 1
+            elif i:
+                new = ms.sector_length or 0
+                self.nextra += 1
+            if new is not None:
+                self.good[chs] = new
+            changed |= old != new
+        self.dirty = set()
+        if changed:
+            self.goodset = None
+            self.goodset_lines = None
+
+    def good_set(self):
+        ''' The CHSSet of the good sectors, payload is the length of extra sectors '''
+        self.refresh_status()
+        if self.goodset is None:
+            self.goodset = CHSSet()
+            for chs, payload in sorted(self.good.items()):
+                self.goodset.add(chs, payload=payload)
+        return self.goodset
+
+    def summary(self, long=False):
+        self.refresh_status()
+        l = [ self.name ]
+        if self.ngood == 0 and self.nextra == 0:
+            l.append("NOTHING")
+        elif self.n_expected and self.ngood == self.n_expected:
+            l.append("COMPLETE")
+            if self.nextra:
+                l.append("EXTRA")
+        else:
+            l.append("✓: %d " % len(self.good))
+        if self.weird_ams:
+             l.append("AM!%d" % self.weird_ams)
+        retval = "  ".join(l)
         if long:
-            for x in self.goodset:
+            if self.goodset_lines is None:
+                self.goodset_lines = list(self.good_set())
+            for x in self.goodset_lines:
                 retval += "\n\t" + x
         return retval
 
     def any_good(self):
-        for ms in sorted(self.sectors.values()):
-            i, _j, k = self.sector_status(ms)
-            if i:
-                return True
-        return False
+        self.refresh_status()
+        return len(self.good) > 0
 
     def process_stream(self, _source):
         ''' ... '''
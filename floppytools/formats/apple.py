@@ -6,6 +6,8 @@
 '''
 
 from ..base import media
+from ..base import checks
+from ..base import fluxstream
 
 GCR5 = {
     0xab: 0x00, 0xad: 0x01, 0xae: 0x02, 0xaf: 0x03,
@@ -62,7 +64,9 @@ class AppleII(media.Media):
         def bit_slicer():
             ''' Estimate clock frequency and decode bits '''
 
-            for dt in stream.iter_dt():
+            for n, dt in enumerate(stream.iter_dt()):
+                if not n % fluxstream.BUDGET_INTERVAL:
+                    stream.check_budget()
                 self.x += dt
                 if dt < 120:
                     self.clock += (dt - self.clock) / 200
@@ -166,19 +170,19 @@ class AppleII(media.Media):
 
                     # 2 bytes to catch surplus bits
                     data = [0] * 258
-                    csum = 0
+                    chain = checks.running_xor(d6)
 
                     # 0x56 = round_up(256/3)
-                    for i, b in enumerate(d6[:0x56]):
-                        csum ^= b
+                    for i, csum in enumerate(chain[:0x56]):
                         data[i + 0x00] |= ((csum >> 1) & 1) | ((csum << 1) & 2)
                         data[i + 0x56] |= ((csum >> 3) & 1) | ((csum >> 1) & 2)
                         data[i + 0xac] |= ((csum >> 5) & 1) | ((csum >> 3) & 2)
 
-                    for i, b in enumerate(d6[0x56:]):
-                        csum ^= b
+                    for i, csum in enumerate(chain[0x56:]):
                         data[i] |= (csum << 2)
 
+                    csum = chain[-1]
+
                     if csum:
                         self.trace("BAD CHECKUM", am.hex(), "%02x" % csum)
                         continue
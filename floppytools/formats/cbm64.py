@@ -5,7 +5,12 @@
    ================================
 '''
 
+import bisect
+import re
+
 from ..base import media
+from ..base import checks
+from ..base import fluxstream
 
 GCR = {
     0x0a: 0x0,
@@ -26,19 +31,114 @@ GCR = {
     0x15: 0xf,
 }
 
+# Two GCR nibbles (10 bits) to one octet
+GCR_BYTE = {
+    bin(0x400 | (hi << 5) | lo)[3:]: (GCR[hi] << 4) | GCR[lo]
+    for hi in GCR
+    for lo in GCR
+}
+
+# A run of valid GCR nibbles
+GCR_RUN = re.compile('(?:' + '|'.join(bin(0x20 | x)[3:] for x in GCR) + ')*')
+
 class CBM64(media.Media):
     ''' Commodore 4040/1541 floppy disks '''
 
+    SYNC_BITS = 20
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.define_geometry((1, 0, 0), (17, 0, 20), 256)
         self.define_geometry((18, 0, 0), (24, 0, 18), 256)
         self.define_geometry((25, 0, 0), (30, 0, 17), 256)
         self.define_geometry((31, 0, 0), (35, 0, 16), 256)
-        self.x = 0
         self.dx = 0
         self.clock = 64
 
+    def bit_slice(self, stream):
+        '''
+           Estimate clock frequency and decode bits
+
+           Returns the bits as a '0'/'1' string, together with the
+           index of the last bit and the stream position of each flux
+           transition, so bit positions can be mapped back to the stream.
+        '''
+
+        clock = 64
+        x = 0
+        bits = []
+        ends = []
+        xs = []
+        nbit = -1
+        for n, dt in enumerate(stream.iter_dt()):
+            if not n % fluxstream.BUDGET_INTERVAL:
+                stream.check_budget()
+            x += dt
+            if dt < 96:
+                clock += (dt - clock) / 200
+            w = dt / clock
+            if w < 1.5:
+                bits.append('1')
+                nbit += 1
+            elif w < 2.5:
+                bits.append('01')
+                nbit += 2
+            else:
+                bits.append('001')
+                nbit += 3
+            ends.append(nbit)
+            xs.append(x)
+        self.clock = clock
+        return ''.join(bits), ends, xs
+
+    def iter_blocks(self, bits):
+        '''
+           Locate sync and decode GCR blocks
+
+           A sync is SYNC_BITS ones followed by a zero, which is the
+           first bit of the block.  The block runs until the first
+           invalid GCR nibble, and the search for the next sync
+           starts after that nibble.
+        '''
+
+        sync = '1' * self.SYNC_BITS
+        pos = 0
+        while True:
+            pos = bits.find(sync, pos)
+            if pos < 0:
+                return
+            start = bits.find('0', pos + self.SYNC_BITS)
+            if start < 0:
+                return
+            end = GCR_RUN.match(bits, start).end()
+            nbytes = min((end - start) // 10, 258)
+            yield start, bytes(
+                GCR_BYTE[bits[i:i+10]] for i in range(start, start + nbytes * 10, 10)
+            )
+            pos = end + 5
+
+    def data_slicer(self, bits):
+        ''' Decode octets and check checksums '''
+
+        for start, octets in self.iter_blocks(bits):
+            if not octets:
+                continue
+            if octets[0] == 8:
+                length = 6
+            elif octets[0] == 7:
+                length = 258
+            else:
+                self.trace("BAD DATA", octets[:1].hex())
+                continue
+            if len(octets) < length:
+                continue
+            octets = octets[:length]
+            csum = checks.xor_sum(octets[1:])
+            if csum == 0:
+                yield start, octets
+            else:
+                self.trace("BAD SUM", "%02x" % csum, octets.hex)
+
     def process_stream(self, stream):
 
         retval = False
@@ -47,115 +147,14 @@ class CBM64(media.Media):
             # I wonder if we can decode the B side of "flip" disks backwards on the odd tracks ?
             return retval
 
-        self.x = 0
-        self.dx = 0
         self.clock = 64
 
-        def bit_slicer():
-            ''' Estimate clock frequency and decode bits '''
-
-            for dt in stream.iter_dt():
-                self.x += dt
-                if dt < 96:
-                    self.clock += (dt - self.clock) / 200
-                w = dt / self.clock
-                if w < 1.5:
-                    yield 1
-                elif w < 2.5:
-                    yield 0
-                    yield 1
-                else:
-                    yield 0
-                    yield 0
-                    yield 1
-
-        def nibble_slicer():
-            ''' Locate sync and decode GCR nibbles '''
-
-            bsl_iter = bit_slicer()
-            while True:
-                acc = [0] * 20
-                while True:
-                    try:
-                        b = next(bsl_iter)
-                    except StopIteration:
-                        yield -1
-                        return
-                    w = acc[-5] << 4
-                    w += acc[-4] << 3
-                    w += acc[-3] << 2
-                    w += acc[-2] << 1
-                    w += acc[-1] << 0
-                    if 0 not in acc and not b:
-                        self.dx = self.x
-                        break
-                    acc.append(b)
-                    acc.pop(0)
-                while True:
-                    h = b << 4
-                    try:
-                        h += next(bsl_iter) << 3
-                        h += next(bsl_iter) << 2
-                        h += next(bsl_iter) << 1
-                        h += next(bsl_iter) << 0
-                    except StopIteration:
-                        yield -1
-                        return
-                    hh = GCR.get(h, -1)
-                    yield hh
-                    if hh < 0:
-                        break
-                    try:
-                        b = next(bsl_iter)
-                    except StopIteration:
-                        yield -1
-                        return
-
-        def data_slicer():
-            ''' Decode octets and check checksums '''
-
-            nsl_iter = nibble_slicer()
-            run = True
-            while run:
-                csum = 0
-                octets = []
-                fail = False
-                while True:
-                    try:
-                        h = next(nsl_iter)
-                        if h < 0:
-                            break
-                        l = next(nsl_iter)
-                        if l < 0:
-                            break
-                        if fail:
-                            continue
-                        o = (h << 4) | l
-                        octets.append(o)
-                        if len(octets) > 1:
-                            csum ^= o
-                        if octets[0] == 8 and len(octets) == 6:
-                            if csum == 0:
-                                yield bytes(octets)
-                            else:
-                                self.trace("BAD SUM", "%02x" % csum, bytes(octets).hex())
-                                fail = True
-                        elif octets[0] == 7 and len(octets) == 258:
-                            if csum == 0:
-                                yield bytes(octets)
-                            else:
-                                self.trace("BAD SUM", "%02x" % csum, bytes(octets).hex())
-                                fail = True
-                        elif octets[0] not in (7, 8):
-                            self.trace("BAD DATA", bytes(octets).hex())
-                            fail = True
-                    except StopIteration:
-                        run = False
-                        break
+        bits, ends, xs = self.bit_slice(stream)
 
         amx = -1
         am = b''
-        for r in data_slicer():
+        for start, r in self.data_slicer(bits):
+            self.dx = xs[bisect.bisect_left(ends, start)]
             if r[0] == 8:
                 am = r
                 amx = self.dx
@@ -5,12 +5,20 @@
    ~~~~~~~~~~~~~~~~~~~~~
 '''
 
-import crcmod
-
 from ..base import media
+from ..base import checks
 from ..base import fluxstream as fs
 
-crc_func = crcmod.predefined.mkCrcFun('crc-ccitt-false')
+crc_func = checks.crc16_ccitt_false
+
+# Each two character flux cell becomes one byte: the first (clock)
+# character weighs two, the second (data) character weighs one.
+CELL_CLOCK = bytes.maketrans(b'|-', b'\x02\x00')
+CELL_DATA = bytes.maketrans(b'|-', b'\x01\x00')
+
+# '|?' is a one, '-|' and '--' are zeros unless they form '-|---|---|'
+CELL_SYMBOL = bytes.maketrans(b'\x00\x01\x02\x03', b'BC11')
+SYMBOL_BITS = bytes.maketrans(b'BCZ', b'000')
 
 class DecRx02(media.Media):
 
@@ -25,6 +33,9 @@ class DecRx02(media.Media):
     DATA_WIN_LO = 550
     DATA_WIN_HI = 800
 
+    AM_PATTERN = '|---' * GAP1 + fs.make_mark_fm(*ADDRESS_MARK)
+    HDDATA_PATTERN = '|---' * GAP1 + fs.make_mark_fm(*HDDATA_MARK)
+
     def validate_address_mark(self, address_mark):
         ''' ... '''
 
@@ -37,13 +48,10 @@ class DecRx02(media.Media):
         if not self.defined_chs(schs):
             return None
 
-        am_pattern = '|---' * self.GAP1 + fs.make_mark_fm(*self.ADDRESS_MARK)
-        hddata_pattern = '|---' * self.GAP1 + fs.make_mark_fm(*self.HDDATA_MARK)
-
         flux = stream.mfm_flux()
 
         retval = False
-        for am_pos in stream.iter_pattern(flux, pattern=am_pattern):
+        for am_pos in stream.iter_pattern(flux, pattern=self.AM_PATTERN):
 
             address_mark = stream.flux_data_fm(flux[am_pos-32:am_pos+(6*32)])
             #print("AM", address_mark.hex(), flux[am_pos-32:am_pos+(6*32)])
@@ -55,17 +63,17 @@ class DecRx02(media.Media):
                 continue
 
             chs = (address_mark[1], address_mark[2], address_mark[3])
-            if not self.defined_chs(chs):
+            if not self.defined_chs(chs) or self.sector_settled(chs, stream):
                 continue
 
             data_pos = flux.find(
-                hddata_pattern,
+                self.HDDATA_PATTERN,
                 am_pos + self.DATA_WIN_LO,
                 am_pos + self.DATA_WIN_HI
             )
             if data_pos < 0:
                 continue
-            data_pos += len(hddata_pattern)
+            data_pos += len(self.HDDATA_PATTERN)
 
             data_flux = flux[data_pos:data_pos+(2 + self.SECTOR_SIZE) * 16 + 32]
             if ' ' in data_flux:
@@ -79,24 +87,32 @@ class DecRx02(media.Media):
         return retval
 
     def flux_to_bytes(self, flux):
-        ''' RX02 uses a modified MFM encoding '''
-        l = []
-        i = 0
-        fflux = flux + '||||||||||||||||'
-        while i < 2*(2+self.SECTOR_SIZE)*8:
-            if fflux[i] == '|':
-                j = '1'
-            elif fflux[i:i+10] == '-|---|---|':
-                j = '01111'
-            else:
-                j = '0'
-            l.append(j)
-            i += len(j) * 2
-        l = "".join(l)
-        j = []
-        for i in range(0, len(l), 8):
-            j.append(int(l[i:i+8], 2))
-        data = bytes(j)
+        '''
+           RX02 uses a modified MFM encoding
+
+           Each flux cell is one bit, '|?' is a one and everything
+           else a zero, except that '-|---|---|' is 01111.
+        '''
+
+        ncell = (2 + self.SECTOR_SIZE) * 8
+        width = ncell + 5
+        fflux = flux + '|' * max(16, 2 * width - len(flux))
+        octets = fflux[:2 * width].encode('ascii')
+        cells = int.from_bytes(octets[0::2].translate(CELL_CLOCK), 'big')
+        cells += int.from_bytes(octets[1::2].translate(CELL_DATA), 'big')
+        symbols = cells.to_bytes(width, 'big').translate(CELL_SYMBOL)
+        symbols = symbols.replace(b'CBCBC', b'Z1111')
+
+        # A '-|---|---|' straddling the end is taken in full
+        i = symbols.rfind(b'Z', 0, ncell)
+        if i >= 0:
+            ncell = max(ncell, i + 5)
+        bits = symbols[:ncell].translate(SYMBOL_BITS)
+
+        nfull = len(bits) & ~7
+        data = int(bits[:nfull], 2).to_bytes(nfull // 8, 'big')
+        if nfull < len(bits):
+            data += bytes([int(bits[nfull:], 2)])
         return data
 
 ALL = [
@@ -5,16 +5,20 @@
    ~~~~~~~~~~
 '''
 
+import bisect
 import os
 import time
-import crcmod
+
+from collections import Counter
 
 from ..base import media
+from ..base import checks
 from ..base import fluxstream as fs
 
 from ..base import chsset
+from ..base.layout import median
 
-crc_func = crcmod.predefined.mkCrcFun('crc-ccitt-false')
+crc_func = checks.crc16_ccitt_false
 
 class IbmTrack():
     ''' ... '''
@@ -50,17 +54,21 @@ class IbmFmTrack(IbmTrack):
                 chs = (address_mark[1], address_mark[2], address_mark[3])
             sector_size = 128 << address_mark[4]
             extra = [ "mode=FM", "clock=%d" % clock]
+            if am_crc == 0 and thismedia.sector_settled(chs, stream):
+                yield am_pos, chs, None, extra
+                continue
             data_pos = flux.find(self.DATA_PATTERN, am_pos, am_pos + self.MAX_GAP2 * 32)
             if data_pos < 0:
                 data_pos = flux.find(self.DELETE_PATTERN, am_pos, am_pos + self.MAX_GAP2 * 32)
                 if data_pos >= 0:
                     extra.append("deleted")
             if data_pos < 0:
-                thismedia.trace(
+                thismedia.trace_dump(
+                    stream.chs[:2],
                     "NOFLAG",
                     "%10d" % am_pos,
-                    address_mark.hex(),
-                    flux[am_pos:am_pos + 6000]
+                    address_mark.hex,
+                    lambda: flux[am_pos:am_pos + 6000]
                 )
                 continue
 
@@ -75,19 +83,25 @@ class IbmFmTrack(IbmTrack):
                 thismedia.trace(
                     "DATACRC",
                     "%10d" % am_pos,
-                    address_mark.hex(),
+                    address_mark.hex,
                     hex(data_crc),
                     len(data),
-                    data.hex()
+                    data[:32].hex
                 )
-                thismedia.trace(
+                thismedia.trace_dump(
+                    stream.chs[:2],
                     "FLUX",
                     "%10d" % am_pos,
-                    address_mark.hex(),
-                    flux[am_pos:am_pos + 6000]
+                    address_mark.hex,
+                    lambda: flux[am_pos:am_pos + 6000]
                     # flux[data_pos-32:data_pos+(8+sector_size*32)]
                 )
-                continue
+                # The data mark itself is known good
+                suspects = stream.suspect_bits("fm", clock, data_pos-32, 2, 4, len(data) * 8)
+                data = thismedia.repair_sector(crc_func, data, [x for x in suspects if x >= 8])
+                if data is None:
+                    continue
+                extra.append("repaired")
 
             yield am_pos, chs, data[1:1+sector_size], extra
 
@@ -107,8 +121,24 @@ class IbmMfmTrack(IbmTrack):
 
     MAX_GAP2 = 60
 
+    # Data field decoding starts in the data mark
+    DATA_OFFSET = -4*16
+
+    # Revolutions needed to fuse a sector, and how far from the same
+    # rotational position, as a fraction of a revolution, they may be.
+    FUSE_MIN = 3
+    FUSE_SLACK = 1/64
+
+    # Alternative (RATE, LIMIT) for the clock recovery of failed sectors
+    REDECODE = ((40e-3, 12.5), (160e-3, 12.5), (80e-3, 8), (80e-3, 20))
+    REDECODE_SLACK = 64
+
     def process_stream(self, thismedia, stream, clock=50):
         flux = stream.mfm_flux(clock)
+        anchors = []
+        misses = []
+        # chs which decoded in some revolution of this stream
+        decoded = set()
         for am_pos in stream.iter_pattern(flux, pattern=self.AM_PATTERN):
             address_mark = stream.flux_data_mfm(flux[am_pos-64:am_pos+(6*16)])
             if address_mark is None:
@@ -119,34 +149,175 @@ class IbmMfmTrack(IbmTrack):
                 thismedia.trace("AMCRC", am_pos)
                 continue
             chs = (address_mark[4], address_mark[5], address_mark[6])
+            sector_size = 128 << address_mark[7]
+            anchors.append((am_pos, chs, sector_size))
 
             extra = [ "mode=MFM", "clock=%d" % clock]
-            data_pos = flux.find(self.DATA_PATTERN, am_pos + 20 * 16, am_pos + self.MAX_GAP2 * 16)
-            if data_pos < 0:
-                data_pos = flux.find(self.DELETE_PATTERN, am_pos, am_pos + self.MAX_GAP2 * 16)
-                if data_pos >= 0:
-                    extra.append("deleted")
-            if data_pos < 0:
-                thismedia.trace("NOFLAG", am_pos)
+            if thismedia.sector_settled(chs, stream):
+                decoded.add(chs)
+                yield am_pos, chs, None, extra
                 continue
-            data_pos += len(self.DATA_PATTERN)
 
-            sector_size = 128 << address_mark[7]
+            data = self.read_data(thismedia, stream, flux, clock, am_pos, sector_size, extra)
+            if data is not None:
+                decoded.add(chs)
+                yield am_pos, chs, data, extra
+            else:
+                misses.append((am_pos, chs, sector_size))
+
+        yield from self.fused_sectors(thismedia, stream, flux, clock, decoded, misses)
+        yield from self.predicted_sectors(thismedia, stream, flux, clock, anchors)
+
+    def find_data(self, flux, am_pos, extra, slack=0):
+        ''' Find the data mark following the address mark at am_pos '''
+
+        hi = am_pos + self.MAX_GAP2 * 16 + slack
+        data_pos = flux.find(self.DATA_PATTERN, am_pos + 20 * 16 - slack, hi)
+        if data_pos < 0:
+            data_pos = flux.find(self.DELETE_PATTERN, am_pos - slack, hi)
+            if data_pos >= 0:
+                extra.append("deleted")
+        if data_pos < 0:
+            return data_pos
+        return data_pos + len(self.DATA_PATTERN)
+
+    def read_data(self, thismedia, stream, flux, clock, am_pos, sector_size, extra, slack=0):
+        ''' Read the data field following the address mark at am_pos '''
+
+        data_pos = self.find_data(flux, am_pos, extra, slack)
+        if data_pos < 0:
+            thismedia.trace("NOFLAG", am_pos)
+            return None
+
+        data = self.data_field(stream, flux, data_pos, sector_size)
+        if data is None:
+            thismedia.trace("NODATA", am_pos)
+        else:
+            data_crc = crc_func(data)
+            if not data_crc:
+                return data[4:4+sector_size]
+            thismedia.trace("DATACRC", am_pos, len(data), hex(data_crc), data[:32].hex)
+
+        retval = self.redecode(thismedia, stream, clock, am_pos, data_pos, sector_size, extra)
+        if retval is not None or data is None:
+            return retval
 
-            off = -4*16
+        # The data mark itself is known good
+        off = self.DATA_OFFSET
+        suspects = stream.suspect_bits("mfm", clock, data_pos+off, 1, 2, len(data) * 8)
+        data = thismedia.repair_sector(crc_func, data, [x for x in suspects if x >= 32])
+        if data is None:
+            return None
+        extra.append("repaired")
+        return data[4:4+sector_size]
+
+    def data_field(self, stream, flux, data_pos, sector_size):
+        ''' Decode the data field, including the data mark and CRC '''
+        off = self.DATA_OFFSET
+        width = (6 + sector_size) * 16
+        return stream.flux_data_mfm(flux[data_pos+off:data_pos+width+off])
+
+    def redecode(self, thismedia, stream, clock, am_pos, data_pos, sector_size, extra):
+        '''
+           Run the clock recovery again for just this sector
+
+           It starts from the checkpoint before the address mark,
+           with each of the REDECODE settings in turn.
+        '''
+        end = data_pos + (6 + sector_size) * 16 + self.REDECODE_SLACK
+        for pll_rate, pll_limit in self.REDECODE:
+            base, flux = stream.reflux("mfm", clock, am_pos, end, pll_rate, pll_limit)
+            pos = self.find_data(flux, am_pos - base, [], self.REDECODE_SLACK)
+            if pos < 0:
+                continue
+            data = self.data_field(stream, flux, pos, sector_size)
+            if data is None or len(data) < 6 + sector_size or crc_func(data):
+                continue
+            thismedia.trace("REDECODED", am_pos, pll_rate, pll_limit)
+            extra.append("redecoded")
+            return data[4:4+sector_size]
+        return None
+
+    def fused_sectors(self, thismedia, stream, flux, clock, decoded, misses):
+        '''
+           Fuse the data fields of sectors which failed in every revolution
+
+           The flux of each revolution is aligned on the data mark,
+           and a per cell majority vote is decoded.  If we know where
+           the index pulses are, only readings at the same rotational
+           position are used, in case the sector ID occurs elsewhere.
+        '''
+
+        groups = {}
+        for am_pos, chs, sector_size in misses:
+            if chs not in decoded:
+                groups.setdefault((chs, sector_size), []).append(am_pos)
+        groups = {k: v for k, v in groups.items() if len(v) >= self.FUSE_MIN}
+        if not groups:
+            return
+
+        index = stream.index_positions(flux)
+        if len(index) > 1:
+            revolution = (index[-1] - index[0]) / (len(index) - 1)
+        for (chs, sector_size), positions in groups.items():
+            if thismedia.sector_settled(chs, stream):
+                continue
+            if len(index) > 1:
+                rots = [
+                    (x - index[bisect.bisect_right(index, x) - 1]) % revolution
+                    for x in positions
+                ]
+                center = median(rots)
+                positions = [
+                    x for x, y in zip(positions, rots)
+                    if abs(y - center) < revolution * self.FUSE_SLACK
+                ]
+                if len(positions) < self.FUSE_MIN:
+                    continue
+
+            extra = [ "mode=MFM", "clock=%d" % clock, "fused"]
+            off = self.DATA_OFFSET
             width = (6 + sector_size) * 16
-            data = stream.flux_data_mfm(flux[data_pos+off:data_pos+width+off])
-            if data is None:
-                thismedia.trace("NODATA", am_pos)
+            windows = []
+            for am_pos in positions:
+                data_pos = self.find_data(flux, am_pos, extra)
+                if data_pos >= 0:
+                    windows.append(flux[data_pos+off:data_pos+width+off])
+            if len(windows) < self.FUSE_MIN:
                 continue
-
-            data_crc = crc_func(data)
-
-            if data_crc != 0:
-                thismedia.trace("DATACRC", am_pos, len(data), hex(data_crc), data[:32].hex())
+            data = stream.flux_data_mfm(fs.fuse_flux(windows))
+            if data is None or len(data) < 6 + sector_size or crc_func(data):
+                thismedia.trace("FUSECRC", positions[0], chs, len(windows))
                 continue
-
-            yield am_pos, chs, data[4:4+sector_size], extra
+            thismedia.trace("FUSED", positions[0], chs, len(windows))
+            yield positions[0], chs, data[4:4+sector_size], sorted(set(extra))
+
+    def predicted_sectors(self, thismedia, stream, flux, clock, anchors):
+        '''
+           Look for sectors whose address mark we did not find
+
+           The track layout predicts where they should be, so we only
+           search for the data mark in a small window around that.
+        '''
+
+        layout = thismedia.layouts.get(stream.chs[:2])
+        if layout is None or not anchors:
+            return
+        cyl, head, _sec = anchors[0][1]
+        sector_size = Counter(x[2] for x in anchors).most_common(1)[0][0]
+        for am_pos, sec, slack in layout.predict(
+            [(x[0], x[1][2]) for x in anchors],
+            len(flux),
+        ):
+            chs = (cyl, head, sec)
+            if thismedia.sector_settled(chs, stream):
+                continue
+            extra = [ "mode=MFM", "clock=%d" % clock, "predicted"]
+            data = self.read_data(thismedia, stream, flux, clock, am_pos, sector_size, extra, slack)
+            if data is None:
+                continue
+            thismedia.trace("PREDICTED", am_pos, chs)
+            yield am_pos, chs, data, extra
 
 class Ibm(media.Media):
 
@@ -170,19 +341,61 @@ class Ibm(media.Media):
     META_FORMAT = "IMAGEDISK"
 
     def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
         self.todo = []
         for i in self.CLOCKS:
             self.todo.append((self.FMTRACK, i,))
             self.todo.append((self.MFMTRACK, i,))
+        # (cyl, head) -> (track, clock) which worked
+        self.track_settings = {}
+        super().__init__(*args, **kwargs)
+
+    def add_read_sector(self, read_sector):
+        ''' Also learn the mode and clock of the track, also from the cache '''
+        super().add_read_sector(read_sector)
+        setting = self.flags_setting(read_sector.flags)
+        if setting is not None:
+            self.track_settings[read_sector.phys_chs[:2]] = setting
+
+    def flags_setting(self, flags):
+        ''' The (track, clock) from the flags of a reading '''
+        for track, clock in self.todo:
+            if "clock=%d" % clock not in flags:
+                continue
+            if "mode=FM" in flags and track is self.FMTRACK:
+                return track, clock
+            if "mode=MFM" in flags and track is self.MFMTRACK:
+                return track, clock
+        return None
+
+    def probe_order(self, chs):
+        '''
+           The order to try (track, clock) in
+
+           First what worked on this track, then what worked on
+           the nearest tracks, and finally the rest of self.todo.
+        '''
+        order = []
+        for _trk, setting in sorted(
+            self.track_settings.items(),
+            key=lambda x: (abs(x[0][0] - chs[0]), x[0][1] != chs[1], x[0]),
+        ):
+            if setting not in order:
+                order.append(setting)
+        for setting in self.todo:
+            if setting not in order:
+                order.append(setting)
+        return order
 
     def process_stream(self, stream):
         ''' ...  '''
 
         retval = False
-        for _i in range(len(self.todo)):
-            track, clock = self.todo[0]
+        for track, clock in self.probe_order(stream.chs):
             for rel_pos, chs, data, extra in track.process_stream(self, stream, clock):
+                retval = True
+                if data is None:
+                    # Settled sector, the mode and clock is still right
+                    continue
                 self.did_read_sector(
                     stream,
                     rel_pos,
@@ -190,10 +403,11 @@ class Ibm(media.Media):
                     data,
                     flags=extra,
                 )
-                retval = True
             if retval:
+                self.track_settings[stream.chs[:2]] = (track, clock)
+                self.todo.remove((track, clock))
+                self.todo.insert(0, (track, clock))
                 return retval
-            self.todo.append(self.todo.pop(0))
         return False
 
     def bin_file_name(self):
@@ -4,12 +4,11 @@
    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 '''
 
-import crcmod
-
 from ..base import media
+from ..base import checks
 from ..base import fluxstream as fs
 
-crc_func = crcmod.predefined.mkCrcFun('xmodem')
+crc_func = checks.crc16_xmodem
 
 class IntelIsis(media.Media):
 
@@ -43,7 +42,7 @@ class IntelIsis(media.Media):
 
             chs = (address_mark[1], address_mark[2], address_mark[3])
             ms = self.sectors.get(chs)
-            if ms is None:
+            if ms is None or self.sector_settled(chs, stream):
                 continue
 
             data_pos = flux.find(data_pattern, am_pos + 200)
@@ -61,11 +60,16 @@ class IntelIsis(media.Media):
             if data is None:
                 continue
 
+            flags = []
             data_crc = crc_func(data[:131])
             if data_crc:
-                continue
+                suspects = stream.suspect_bits("m2fm", 50, data_pos + 1, 1, 2, 131 * 8)
+                data = self.repair_sector(crc_func, data[:131], [x for x in suspects if x >= 8])
+                if data is None:
+                    continue
+                flags.append("repaired")
 
-            self.did_read_sector(stream, am_pos, chs, data[1:self.SECTOR_SIZE+1])
+            self.did_read_sector(stream, am_pos, chs, data[1:self.SECTOR_SIZE+1], flags)
             retval = True
         return retval
 
@@ -5,10 +5,15 @@
    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 '''
 
+import re
+
 from ..base import media
+from ..base import checks
+
+# '|---' is a one, '|-|-' is a zero, anything else is skipped
+FM_CELL = re.compile('[|]---|[|]-[|]-')
 
-class RxErr(Exception):
-    ''' ... '''
+FM_BITS = str.maketrans('-|', '10')
 
 class OhioScientificU(media.Media):
 
@@ -17,61 +22,24 @@ class OhioScientificU(media.Media):
     SECTOR_SIZE = 0xf << 8
     GEOMETRY = ((0, 0, 0), (76, 0, 0), SECTOR_SIZE)
 
+    def fm_bits(self, flux):
+        ''' Classify FM cells into an async serial bit-string '''
+        return ''.join(FM_CELL.findall(flux))[2::4].translate(FM_BITS)
+
     def process_stream(self, stream):
         self.retval = False
 
-        flux = stream.fm_flux()
+        # The entire track is one sector
+        if self.sector_settled((stream.chs[0], stream.chs[1], 0)):
+            return self.retval
 
-        def fm():
-            ''' One FM coded bit '''
-            n = 0
-            while n < len(flux):
-                cell = flux[n:n+4]
-                if cell == '|---':
-                    yield 1
-                    n += 4
-                elif cell == '|-|-':
-                    yield 0
-                    n += 4
-                else:
-                    n += 1
+        flux = stream.fm_flux()
 
-        fmi = fm()
-
-        def element(nbit):
-            ''' One async element (byte+parity+stopbit) '''
-            g = 0
-            while next(fmi):
-                g += 1
-                continue
-            c = 0
-            for i in range(nbit):
-                c += next(fmi) << i
-            return g, c
-
-        def rx8e():
-            ''' 8 bits with even parity '''
-            gap, bits = element(10)
-            if bits == 0:
-                raise RxErr("Break")
-            if not bits & 0x200:
-                raise RxErr("Stop-Bit")
-            par = bin(bits).count('1')
-            if not par & 1:
-                raise RxErr("Parity")
-            return gap, bits & 0xff
-
-        def rx8n():
-            ''' 8 bits with no parity '''
-            gap, bits = element(9)
-            if bits == 0:
-                raise RxErr("Break")
-            if not bits & 0x100:
-                raise RxErr("Stop-Bit")
-            return gap, bits & 0xff
+        bits = self.fm_bits(flux)
 
         def got(l):
             ''' we think we got a sector (=track) '''
+            stream.check_budget()
             if len(l) > 3000:
                 b = bytes(l)
                 if stream.chs[0] == 0:
@@ -86,8 +54,8 @@ class OhioScientificU(media.Media):
                         self.retval = True
                     check = None
                 elif len(b) >= 3590:
-                    cs = sum(b[:3588]) & 0xffff
-                    rs = (b[3588] << 8) | b[3589]
+                    cs = checks.byte_sum(b[:3588], width=16)
+                    rs = int.from_bytes(b[3588:3590], 'big')
                     check = cs == rs
                     if check:
                         self.did_read_sector(
@@ -105,24 +73,36 @@ class OhioScientificU(media.Media):
             return []
 
         l = []
+        pos = 0
         while True:
-            try:
-                if stream.chs[0] == 0 or len(l) < 3:
-                    gap, val = rx8e()
-                else:
-                    gap, val = rx8n()
-                if stream.chs[0] > 0 and len(l) == 3 and gap:
-                    if len(l) == 3 and gap < 30 and val >= 0xf0:
-                        # Ignore transient from UART being switched from 8E to 8N
-                        self.trace("gap", gap, hex(val), len(l))
-                        continue
-                    self.trace("GAP", gap, hex(val), len(l))
-            except RxErr:
+            if stream.chs[0] == 0 or len(l) < 3:
+                # 8 bits with even parity
+                nbit = 10
+            else:
+                # 8 bits with no parity
+                nbit = 9
+            start = bits.find('0', pos)
+            if start < 0 or start + 1 + nbit > len(bits):
+                l = got(l)
+                break
+            gap = start - pos
+            pos = start + 1 + nbit
+            frame = bits[start + 1:pos]
+            if frame[-1] != '1':
+                # Stop-Bit (or Break)
                 l = got(l)
                 continue
-            except StopIteration:
+            if nbit == 10 and not frame.count('1') & 1:
+                # Parity
                 l = got(l)
-                break
+                continue
+            val = int(frame[7::-1], 2)
+            if stream.chs[0] > 0 and len(l) == 3 and gap:
+                if len(l) == 3 and gap < 30 and val >= 0xf0:
+                    # Ignore transient from UART being switched from 8E to 8N
+                    self.trace("gap", gap, hex(val), len(l))
+                    continue
+                self.trace("GAP", gap, hex(val), len(l))
             if gap > 400:
                 l = got(l)
             l.append(val)
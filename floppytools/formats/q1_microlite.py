@@ -36,6 +36,7 @@ import struct
 from collections import Counter
 
 from ..base import media
+from ..base import checks
 from ..base import fluxstream
 
 def most_common(lst):
@@ -62,19 +63,35 @@ class Q1MicroLiteCommon(media.Media):
                 self.catalog_entry(chs, rs.octets)
 
     def split_stream(self, flux):
-        ''' Two level split of stream at AM and then Data '''
+        '''
+           Two level split of stream at AM and then Data
+
+           Yields ((am_start, am_end), (data_start, data_end)) index
+           ranges into flux, rather than copies of the pieces.
+        '''
 
-        for i in flux.split(self.AM_PATTERN)[1:]:
-            j = i.split(self.DATA_PATTERN)
+        am_pos = flux.find(self.AM_PATTERN)
+        while am_pos >= 0:
+            start = am_pos + len(self.AM_PATTERN)
+            am_pos = flux.find(self.AM_PATTERN, start)
+            if am_pos < 0:
+                end = len(flux)
+            else:
+                end = am_pos
+            data_pos = flux.find(self.DATA_PATTERN, start, end)
             # There must be a data part
-            if len(j) < 2:
-                self.trace("no DATA_PATTERN", len(i), [len(x) for x in j])
+            if data_pos < 0:
+                self.trace("no DATA_PATTERN", end - start, [end - start])
                 continue
             # Close to the address mark
-            if len(j[0]) > self.GAPLEN:
-                self.trace("Too much gap", len(j[0]), self.GAPLEN)
+            if data_pos - start > self.GAPLEN:
+                self.trace("Too much gap", data_pos - start, self.GAPLEN)
                 continue
-            yield j
+            data_start = data_pos + len(self.DATA_PATTERN)
+            data_end = flux.find(self.DATA_PATTERN, data_start, end)
+            if data_end < 0:
+                data_end = end
+            yield (start, data_pos), (data_start, data_end)
 
     def sector_length(self, stream, chs):
         if chs[0] != stream.chs[0] and not self.cyl_skew:
@@ -175,7 +192,7 @@ class Q1MicroLiteCommon(media.Media):
             flags.append("unused")
         elif not self.good_checksum(data, sector_length):
             if ms:
-                self.trace(chs, "bad checksum", data.hex())
+                self.trace(chs, "bad checksum", data.hex)
             good=False
             flags.append("SumError")
 
@@ -214,20 +231,20 @@ class Q1MicroLiteCommon(media.Media):
         l.insert(1, self.cyl_contains[cyl_no].ljust(10))
         return l
 
-    def guess_sector_length(self, stream, later, conv):
+    def guess_sector_length(self, stream, flux, later, conv):
         # We dont know the sector lenght for this track (yet): Try to guess it
 
         # Find the most common flux-length for data part
 
-        common_length = most_common(len(x[1][1])//16 for x in later)
+        common_length = most_common((x[1][1] - x[1][0])//16 for x in later)
         self.trace("Most common length", common_length)
 
         # Convert from MFM to bytes and locate the last 0x10 value
         sectors = []
         tens = []
         retval = False
-        for chs, parts in later:
-            data = conv(parts[1][:(common_length+2) * 16])
+        for chs, (start, end) in later:
+            data = conv(flux[start:min(end, start + (common_length+2) * 16)])
             sectors.append((chs, data))
             ten_pos = data.rfind(b'\x10')
 
@@ -277,8 +294,7 @@ class Q1MicroLiteFM(Q1MicroLiteCommon):
     GAPLEN = 100*32
 
     def good_checksum(self, data, sector_length):
-        csum = sum(data[:sector_length + 1]) & 0xff
-        return csum == 0
+        return checks.byte_sum(data[:sector_length + 1]) == 0
 
     def am_to_chs(self, stream, flux):
         am_data = stream.flux_data_fm(flux[:6*32])
@@ -290,7 +306,7 @@ class Q1MicroLiteFM(Q1MicroLiteCommon):
             return None
         if am_data[5] != 0x10:
             return None
-        if sum(am_data[:5]) & 0xff:
+        if checks.byte_sum(am_data[:5]):
             return None
         return (am_data[2], 0, am_data[3])
 
@@ -303,14 +319,16 @@ class Q1MicroLiteFM(Q1MicroLiteCommon):
         retval = False
 
         flux = stream.fm_flux()
-        for parts in self.split_stream(flux):
-            chs = self.am_to_chs(stream, parts[0])
-            if chs is None:
+        for am_range, data_range in self.split_stream(flux):
+            stream.check_budget()
+            chs = self.am_to_chs(stream, flux[am_range[0]:am_range[1]])
+            if chs is None or self.sector_settled(chs, stream):
                 continue
             ms, sector_length = self.sector_length(stream, chs)
 
             if sector_length:
-                data = stream.flux_data_fm(parts[1][:(sector_length+2)*32])
+                start, end = data_range
+                data = stream.flux_data_fm(flux[start:min(end, start + (sector_length+2)*32)])
                 if self.attempt_sector(
                     chs,
                     data,
@@ -320,9 +338,9 @@ class Q1MicroLiteFM(Q1MicroLiteCommon):
                 ):
                     retval = True
             else:
-                later.append((chs, parts))
+                later.append((chs, data_range))
 
-        if later and self.guess_sector_length(stream, later, stream.flux_data_fm):
+        if later and self.guess_sector_length(stream, flux, later, stream.flux_data_fm):
             retval = True
         return retval
 
@@ -352,19 +370,45 @@ class Q1MicroLiteMFM28(Q1MicroLiteCommon):
 
     CLOCK = 28
 
+    # The MFM rates we know of
+    CLOCKS = (28, 39)
+
+    def detect_clock(self, stream):
+        '''
+           Pick the clock from the peak of the histogram
+
+           The peak is one of the 2T, 3T or 4T intervals, the clock
+           with an interval nearest to it wins, but only if it is
+           clearly nearer than the other clocks, otherwise None.
+        '''
+
+        histo = stream.histo
+        if not sum(histo):
+            for _i in stream.iter_dt():
+                continue
+        dt = stream.peak_dt(0, len(histo) * stream.histo_scale)
+        if dt is None:
+            return None
+        dt += stream.histo_scale // 2
+        dist = sorted(
+            (min(abs(n * x - dt) for n in (2, 3, 4)), x) for x in self.CLOCKS
+        )
+        if dist[0][0] * 2 >= dist[1][0]:
+            return None
+        return dist[0][1]
+
     def am_to_chs(self, stream, flux):
         am_data = stream.flux_data_mfm(flux[:4*16])
         if len(am_data) != 4:
             return None
         if am_data[3] != 0x10:
             return None
-        if (am_data[0] + am_data[1]) & 0xff != am_data[2]:
+        if checks.byte_sum(am_data[:2]) != am_data[2]:
             return None
         return (am_data[0], 0, am_data[1])
 
     def good_checksum(self, data, sector_length):
-        csum = (0x9b + sum(data[:sector_length])) & 0xff
-        return csum == data[sector_length]
+        return checks.byte_sum(data[:sector_length], 0x9b) == data[sector_length]
 
     def process_stream(self, stream):
         ''' process a stream '''
@@ -374,16 +418,23 @@ class Q1MicroLiteMFM28(Q1MicroLiteCommon):
         later = []
         retval = False
 
-        flux = ClockRecoveryMFM(self.CLOCK).process(stream.iter_dt())
-        for parts in self.split_stream(flux):
-            chs = self.am_to_chs(stream, parts[0])
-            if chs is None:
+        # Only the variant matching the rate decodes, both if in doubt,
+        # and the recovered flux is shared through the stream's cache.
+        clock = self.detect_clock(stream)
+        if clock is not None and clock != self.CLOCK:
+            return None
+        flux = stream.recovered_flux(ClockRecoveryMFM(self.CLOCK))
+        for am_range, data_range in self.split_stream(flux):
+            stream.check_budget()
+            chs = self.am_to_chs(stream, flux[am_range[0]:am_range[1]])
+            if chs is None or self.sector_settled(chs, stream):
                 continue
 
             ms, sector_length = self.sector_length(stream, chs)
 
             if sector_length:
-                data = stream.flux_data_mfm(parts[1][:(sector_length+2) * 16])
+                start, end = data_range
+                data = stream.flux_data_mfm(flux[start:min(end, start + (sector_length+2) * 16)])
                 if self.attempt_sector(
                     chs,
                     data,
@@ -393,9 +444,9 @@ class Q1MicroLiteMFM28(Q1MicroLiteCommon):
                 ):
                     retval = True
             else:
-                later.append((chs, parts))
+                later.append((chs, data_range))
 
-        if later and self.guess_sector_length(stream, later, stream.flux_data_mfm):
+        if later and self.guess_sector_length(stream, flux, later, stream.flux_data_mfm):
             retval = True
         return retval
 
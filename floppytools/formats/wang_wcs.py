@@ -8,11 +8,10 @@
 
 '''
 
-import crcmod
-
 from ..base import media
+from ..base import checks
 
-crc_func = crcmod.predefined.mkCrcFun('crc-16-buypass')
+crc_func = checks.crc16_buypass
 
 AM_MARK = '--|-' * 32 + '|-' * 3
 DATA_MARK = '--|-' * 24 + '|-' * 3
@@ -41,7 +40,7 @@ class WangWcs(media.Media):
             if max(address_mark[2:]):
                 continue
             chs = (address_mark[0], 0, address_mark[1])
-            if not self.defined_chs(chs):
+            if not self.defined_chs(chs) or self.sector_settled(chs, stream):
                 continue
 
             data_pos = flux.find(DATA_MARK, am_pos + 500)
@@ -53,11 +52,16 @@ class WangWcs(media.Media):
             if data is None:
                 continue
 
+            flags = []
             data_crc = crc_func(b'\x03' + data)
             if data_crc:
-                continue
+                suspects = stream.suspect_bits("fm", 50, data_pos, 2, 4, len(data) * 8)
+                data = self.repair_sector(crc_func, data, suspects, b'\x03')
+                if data is None:
+                    continue
+                flags.append("repaired")
 
-            self.did_read_sector(stream, am_pos, chs, data[:self.SECTOR_SIZE])
+            self.did_read_sector(stream, am_pos, chs, data[:self.SECTOR_SIZE], flags)
             retval = True
         return retval
 
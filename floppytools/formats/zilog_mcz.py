@@ -7,12 +7,11 @@
    ref: 03-3018-03_ZDS_1_40_Hardware_Reference_Manual_May79.pdf
 '''
 
-import crcmod
-
 from ..base import media
+from ..base import checks
 from ..base import fluxstream
 
-crc_func = crcmod.predefined.mkCrcFun('crc-16-buypass')
+crc_func = checks.crc16_buypass
 
 class ZilogMCZ(media.Media):
     ''' ... '''
@@ -22,6 +21,9 @@ class ZilogMCZ(media.Media):
 
     GAP = fluxstream.fm_gap(32)
 
+    # Sector number and track number
+    HEADER_SIZE = 2
+
     def process_stream(self, stream):
         schs = (stream.chs[0], stream.chs[1], 0)
         if not self.defined_chs(schs):
@@ -33,19 +35,37 @@ class ZilogMCZ(media.Media):
         for data_pos in stream.iter_pattern(flux, pattern=self.GAP):
             data_pos -= 4
 
-            data = stream.flux_data_fm(flux[data_pos:data_pos+((2+self.SECTOR_SIZE)*32)])
-            if data is None:
+            # Reject on the header before decoding the rest of the sector
+            hdr_end = data_pos + self.HEADER_SIZE * 32
+            hdr = stream.flux_data_fm(flux[data_pos:hdr_end])
+            if hdr is None or len(hdr) < self.HEADER_SIZE:
                 continue
 
-            data_crc = crc_func(data)
-            if data_crc != 0:
+            chs = (hdr[1], 0, hdr[0] & 0x7f)
+            if not self.defined_chs(chs) or self.sector_settled(chs, stream):
                 continue
 
-            chs = (data[1], 0, data[0] & 0x7f)
-            if not self.defined_chs(chs):
+            # The CRC continues from the header
+            rest = stream.flux_data_fm(flux[hdr_end:data_pos+((2+self.SECTOR_SIZE)*32)])
+            if rest is None:
                 continue
 
-            self.did_read_sector(stream, data_pos, chs, data[:-2])
+            flags = []
+            data = hdr + rest
+            data_crc = crc_func(rest, crc_func(hdr))
+            if data_crc != 0:
+                # The header is known good, we found the sector by it
+                suspects = stream.suspect_bits("fm", 50, data_pos, 2, 4, len(data) * 8)
+                data = self.repair_sector(
+                    crc_func,
+                    data,
+                    [x for x in suspects if x >= self.HEADER_SIZE * 8],
+                )
+                if data is None:
+                    continue
+                flags.append("repaired")
+
+            self.did_read_sector(stream, data_pos, chs, data[:-2], flags)
             retval = True
         return retval
 
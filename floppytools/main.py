@@ -11,10 +11,20 @@ import glob
 import time
 
 from .formats import index
+from . import screen
+from .base import media_abc
+from .base import kryostream
+from .base import media
 
 # Dont touch files if mtime is newer than this
 COOLDOWN = 2
 
+# Max screen updates per second in tty mode
+MAX_REFRESH = 4
+
+# Media kept live, when switching between directories
+POOL_SIZE = 4
+
 class Main():
     ''' Common main() implementation '''
 
@@ -23,11 +33,20 @@ class Main():
         self.verbose = 0
         self.defects = {}
         self.mdir = None
-
+        # (dirname, format name) -> live media, least recently used first
+        self.pool = {}
+        # (dirname, format name) which found something in this run
+        self.proven = set()
+        self.screen = None
+        self.body = None
+        self.body_mdir = None
+        self.filename = ""
 
         run_mode = None
         self.ignore_cache = False
         self.just_try = False
+        self.repair = False
+        self.time_budget = None
         self.end_when_complete = False
         self.metaproto = ""
         format_names = []
@@ -37,6 +56,15 @@ class Main():
             if sys.argv[0] == '-a':
                 self.ignore_cache = True
                 sys.argv.pop(0)
+            elif sys.argv[0] == '-b':
+                sys.argv.pop(0)
+                try:
+                    self.time_budget = float(sys.argv.pop(0))
+                except (IndexError, ValueError):
+                    self.time_budget = None
+                if self.time_budget is None or not self.time_budget > 0:
+                    self.usage("-b needs a positive number of seconds")
+                    sys.exit(2)
             elif sys.argv[0] == '-d':
                 sys.argv.pop(0)
                 run_mode = self.dir_mode
@@ -61,9 +89,15 @@ class Main():
             elif sys.argv[0] == "-p":
                 sys.argv.pop(0)
                 self.metaproto = open(sys.argv.pop(0)).read()
+            elif sys.argv[0] == '-r':
+                sys.argv.pop(0)
+                self.repair = True
             elif sys.argv[0] == '-t':
                 sys.argv.pop(0)
                 ttymode = True
+            elif sys.argv[0] == '-v':
+                sys.argv.pop(0)
+                self.verbose += 1
             elif sys.argv[0] == '-w':
                 sys.argv.pop(0)
                 run_mode = self.write_mode
@@ -75,9 +109,10 @@ class Main():
                 break
 
         if ttymode:
-            self.esc_home = "\x1b[H"
-            self.esc_eol = "\x1b[K"
-            self.esc_eos = "\x1b[J"
+            self.esc_home = screen.ESC_HOME
+            self.esc_eol = screen.ESC_EOL
+            self.esc_eos = screen.ESC_EOS
+            self.screen = screen.Screen(sys.stdout, MAX_REFRESH)
         else:
             self.esc_home = ""
             self.esc_eol = ""
@@ -116,10 +151,13 @@ class Main():
         print("--------")
         print("")
         print("  -a                       - ignore cache (= read everything)")
+        print("  -b seconds               - CPU time budget per file and format (default 60)")
         print("  -e                       - end when complete")
         print("  -f format[,format]*      - formats to try")
         print("  -n                       - dont write cache (= just try)")
+        print("  -r                       - repair bit errors using the CRC")
         print("  -t                       - force tty mode (= use escape sequences)")
+        print("  -v                       - more verbose trace files (repeatable)")
         print("")
         print("Formats:")
         print("--------")
@@ -132,29 +170,76 @@ class Main():
             print("\n  " + nm + "\n\t" + ", ".join(sorted(which)))
         print("")
 
-    def sync_media(self):
-        ''' Close a media directory '''
-        if not self.mdir:
-            return
-        self.defects[self.mdir.medianame] = self.mdir.summary(long=True)
-        with open(self.mdir.file_name(".status"), "w", encoding="utf8") as file:
-            file.write("Dirname " + self.mdir.medianame + "\n")
-            for i in self.mdir.picture():
+    def write_status(self, mdir):
+        ''' Write the .status file of a media directory '''
+        self.defects[mdir.medianame] = mdir.summary(long=True)
+        with open(mdir.file_name(".status"), "w", encoding="utf8") as file:
+            file.write("Dirname " + mdir.medianame + "\n")
+            for i in mdir.picture():
                 file.write(i + '\n')
-            for i in sorted(self.mdir.messages):
+            for i in sorted(mdir.messages):
                 file.write(i + '\n')
-            file.write(self.mdir.summary(long=True) + '\n')
-            for i, j in self.mdir.missing():
+            file.write(mdir.summary(long=True) + '\n')
+            for i, j in mdir.missing():
                 file.write("\t" + i + " " + j + "\n")
+            for i in sorted(mdir.timeouts):
+                file.write("Timeout " + i + "\n")
+
+    def pool_media(self, mdir):
+        ''' Keep a media live, evicting the least recently used '''
+        key = (mdir.dirname, mdir.name)
+        self.pool.pop(key, None)
+        self.pool[key] = mdir
+        while len(self.pool) > POOL_SIZE:
+            old = self.pool.pop(next(iter(self.pool)))
+            self.write_status(old)
+            old.close()
+
+    def drop_media(self, mdir):
+        ''' Close a media which turned out to be the wrong format '''
+        self.pool.pop((mdir.dirname, mdir.name), None)
+        mdir.close()
+
+    def pooled_media(self, dirname):
+        ''' The live media for a directory, if any '''
+        for (pdir, _fmt), mdir in self.pool.items():
+            if pdir == dirname:
+                return mdir
+        return None
+
+    def sync_media(self):
+        ''' Write the .status files of the live media '''
+        if self.screen:
+            self.screen.flush()
+        for mdir in self.pool.values():
+            self.write_status(mdir)
+
+    def close_media(self):
+        ''' Write the .status files and close all media '''
+        self.sync_media()
+        for mdir in self.pool.values():
+            mdir.close()
+        self.pool = {}
         self.mdir = None
 
+    def status_line(self, mdir, filename):
+        ''' Single line status '''
+        l0 = [filename] + list(mdir.messages) + [mdir.summary()]
+        return "  ".join(l0)
+
     def mystatus(self, filename):
         ''' Single line status '''
-        l0 = [filename] + list(self.mdir.messages) + [self.mdir.summary()]
-        sys.stdout.write("  ".join(l0) + self.esc_eol + '\n')
+        if self.screen:
+            self.myscreen(filename)
+            return
+        sys.stdout.write(self.status_line(self.mdir, filename) + self.esc_eol + '\n')
 
     def mypicture(self, filename):
         ''' Full Picture '''
+        if self.screen:
+            self.body = None
+            self.myscreen(filename)
+            return
         sys.stdout.write(self.esc_home)
         self.mystatus(filename)
         for line in self.mdir.picture():
@@ -163,36 +248,104 @@ class Main():
             print(self.esc_eol + line)
         sys.stdout.write(self.esc_eos)
 
-    def process_file(self, filename):
+    def myscreen(self, filename):
+        ''' Update the screen in tty mode, the picture only if it changed '''
+        mdir = self.mdir
+
+        def frame():
+            if self.body is None or self.body_mdir is not mdir:
+                self.body = list(mdir.picture())
+                self.body += mdir.summary(long=True).split('\n')
+                self.body_mdir = mdir
+            return [self.status_line(mdir, filename)] + self.body
+
+        self.screen.update(frame)
+
+    def media_event(self, mdir, event, _arg):
+        ''' Show sectors as they are read '''
+        if event == media_abc.EVENT_SECTOR and mdir is self.mdir:
+            self.body = None
+            self.myscreen(self.filename)
+
+    def process_file(self, filename, stream=None):
         ''' Process one file '''
-        retval = self.mdir.process_file(filename)
+        self.filename = filename
+        retval = self.mdir.process_file(filename, stream)
         if retval:
+            self.proven.add((self.mdir.dirname, self.mdir.name))
             self.mypicture(filename)
         else:
             self.mystatus(filename)
         sys.stdout.flush()
         return retval
 
+    def new_media(self, cls, dirname):
+        ''' Instantiate a format for a media directory '''
+        mdir = cls(
+            dirname,
+            load_cache = not self.ignore_cache,
+            save_cache = not self.just_try,
+            repair = self.repair,
+            trace_level = 1 + self.verbose,
+            time_budget = self.time_budget,
+        )
+        if self.screen:
+            mdir.subscribe(self.media_event)
+        return mdir
+
+    def probe_file(self, filename):
+        '''
+           Find the format which decodes a file best
+
+           Returns the format class, None if no format decodes anything,
+           and the stream, so it need not be decoded again.
+        '''
+        stream = kryostream.KryoStream(filename)
+        best = None
+        best_conf = 0
+        for cls in self.format_classes.values():
+            conf = cls.probe(stream, self.time_budget)
+            if conf > best_conf:
+                best = cls
+                best_conf = conf
+        return best, stream
+
+    def marked_format(self, dirname):
+        ''' The format class a previous run found for dirname, if any '''
+        if self.ignore_cache:
+            return None
+        marker = media.read_marker(dirname)
+        if not marker:
+            return None
+        cls = self.format_classes.get(marker[0])
+        if cls is None or cls.VERSION != marker[1]:
+            return None
+        return cls
+
     def process_dir(self, dirname, files):
         ''' Process some files in one directory '''
-        if self.mdir:
-            self.sync_media()
-            self.mdir = None
+        self.mdir = self.pooled_media(dirname)
+        if not self.mdir:
+            marked = self.marked_format(dirname)
+            if marked:
+                self.mdir = self.new_media(marked, dirname)
         for fn in files:
             if not self.mdir:
-                for cls in self.format_classes.values():
-                    self.mdir = cls(
-                        dirname,
-                        load_cache = not self.ignore_cache,
-                        save_cache = not self.just_try,
-                    )
-                    self.process_file(fn)
-                    if self.mdir.any_good():
-                        break
-                    self.mdir = None
-            else:
-                self.process_file(fn)
+                cls, stream = self.probe_file(fn)
+                if cls:
+                    self.mdir = self.new_media(cls, dirname)
+                    self.process_file(fn, stream)
+            elif self.process_file(fn) is False and (dirname, self.mdir.name) not in self.proven:
+                # Not found anything with this format yet, maybe another
+                # format, if the marker was wrong or is stale.
+                cls, stream = self.probe_file(fn)
+                if cls and type(self.mdir) is not cls:
+                    self.drop_media(self.mdir)
+                    self.mdir = self.new_media(cls, dirname)
+                    self.process_file(fn, stream)
             self.files_done.add(fn)
+        if self.mdir:
+            self.pool_media(self.mdir)
 
     def dir_mode(self):
         ''' Process a specific directory '''
@@ -218,7 +371,7 @@ class Main():
         self.process_dir(dirname, sys.argv)
         if self.mdir:
             self.mypicture("")
-        self.sync_media()
+        self.close_media()
 
     def report_incomplete(self):
         ''' Report incomplete media '''
@@ -251,6 +404,8 @@ class Main():
             m += 1
             if m == 3:
                 self.sync_media()
+                if self.screen:
+                    self.screen.invalidate()
                 self.report_incomplete()
                 print()
                 print("Waiting for stream files…")
@@ -290,3 +445,4 @@ class Main():
                 mdir = cls(dirname, load_cache = True, save_cache = False)
                 if mdir.any_good():
                     mdir.write_result(metaproto=self.metaproto)
+                mdir.close()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+'''
+   Terminal output
+   ~~~~~~~~~~~~~~~
+
+   Remembers what is on the screen, and only sends the characters
+   which changed, using cursor addressing, and not more often than
+   max_rate times per second.
+'''
+
+import time
+
+ESC_HOME = "\x1b[H"
+ESC_EOL = "\x1b[K"
+ESC_EOS = "\x1b[J"
+
+def esc_goto(row, col):
+    ''' Cursor addressing, zero based '''
+    return "\x1b[%d;%dH" % (row + 1, col + 1)
+
+class Screen():
+    ''' A diff-based, rate-limited, full screen renderer '''
+
+    def __init__(self, file, max_rate=4):
+        self.file = file
+        self.interval = 1 / max_rate
+        self.lines = None
+        self.pending = None
+        self.last = 0
+
+    def invalidate(self):
+        ''' Something else wrote to the terminal, repaint it all next time '''
+        self.lines = None
+
+    def update(self, frame):
+        '''
+           Show the lines frame() returns
+
+           If we updated the screen less than an interval ago, frame
+           is not called until later, by a later update() or flush().
+        '''
+        self.pending = frame
+        if time.monotonic() - self.last >= self.interval:
+            self.flush()
+
+    def flush(self):
+        ''' Show the pending frame, if any '''
+        if self.pending is None:
+            return
+        frame = self.pending
+        self.pending = None
+        self.show(frame())
+
+    def show(self, lines):
+        ''' Show lines, sending only what changed '''
+        self.last = time.monotonic()
+        out = []
+        if self.lines is None:
+            out.append(ESC_HOME)
+            for line in lines:
+                out.append(line + ESC_EOL + "\n")
+            out.append(ESC_EOS)
+        else:
+            for row, line in enumerate(lines):
+                if row < len(self.lines):
+                    out.append(self.diff_line(row, self.lines[row], line))
+                else:
+                    out.append(esc_goto(row, 0) + line + ESC_EOL)
+            if len(lines) < len(self.lines):
+                out.append(esc_goto(len(lines), 0) + ESC_EOS)
+            out.append(esc_goto(len(lines), 0))
+        self.lines = list(lines)
+        self.file.write("".join(out))
+        self.file.flush()
+
+    def diff_line(self, row, old, new):
+        ''' Escape sequences and characters to change old into new '''
+        if old == new:
+            return ""
+        head = 0
+        for head, (i, j) in enumerate(zip(old, new)):
+            if i != j:
+                break
+        else:
+            head = min(len(old), len(new))
+        if len(old) != len(new):
+            return esc_goto(row, head) + new[head:] + ESC_EOL
+        tail = len(new)
+        while tail > head and old[tail - 1] == new[tail - 1]:
+            tail -= 1
+        return esc_goto(row, head) + new[head:tail]
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+'''
+   Tests of the CRC syndrome repair
+   ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+'''
+
+import random
+
+import pytest
+
+pytest.importorskip("crcmod")
+
+from floppytools.base import checks
+
+crc_func = checks.crc16_ccitt_false
+
+def message(length=128, prefix=b'', seed=1):
+    ''' Random octets followed by their CRC '''
+    rng = random.Random(seed)
+    octets = bytes(rng.randrange(256) for _i in range(length))
+    return octets + crc_func(prefix + octets).to_bytes(2, 'big')
+
+def flip(octets, *bits):
+    ''' Flip bits, zero being the MSB of octets[0] '''
+    x = int.from_bytes(octets, 'big')
+    for bit in bits:
+        x ^= 1 << (len(octets) * 8 - 1 - bit)
+    return x.to_bytes(len(octets), 'big')
+
+def test_good_message():
+    good = message()
+    assert checks.crc_repair(crc_func, good, []) == good
+
+def test_single_bit():
+    good = message()
+    bad = flip(good, 100)
+    assert checks.crc_repair(crc_func, bad, [7, 100, 500]) == good
+
+def test_double_bit():
+    good = message()
+    bad = flip(good, 100, 613)
+    assert checks.crc_repair(crc_func, bad, [613, 3, 100, 900]) == good
+
+def test_not_suspected():
+    bad = flip(message(), 100)
+    assert checks.crc_repair(crc_func, bad, [7, 101, 500]) is None
+
+def test_only_most_suspect():
+    bad = flip(message(), 100)
+    suspects = list(range(200, 200 + checks.MAX_SUSPECTS)) + [100]
+    assert checks.crc_repair(crc_func, bad, suspects) is None
+
+def test_ambiguous():
+    bad = flip(message(), 100, 613)
+    table = checks.crc_syndromes(crc_func, len(bad))
+    syndrome = table[100] ^ table[613]
+    # Another pair of bits with the same syndrome
+    by_syndrome = {table[bit]: bit for bit in range(len(bad) * 8)}
+    pairs = [
+        (bit, by_syndrome.get(syndrome ^ table[bit])) for bit in range(len(bad) * 8)
+    ]
+    other = next(
+        x for x in pairs if x[1] is not None and not set(x) & set((100, 613))
+    )
+    assert checks.crc_repair(crc_func, bad, [100, 613]) is not None
+    assert checks.crc_repair(crc_func, bad, [100, 613] + list(other)) is None
+
+def test_prefix():
+    good = message(prefix=b'\x03')
+    bad = flip(good, 40)
+    assert checks.crc_repair(crc_func, bad, [40], prefix=b'\x03') == good
+    assert checks.crc_repair(crc_func, bad, [40]) is None
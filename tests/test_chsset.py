@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+'''
+   Tests of CHSSet against the former list based implementation
+   ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+'''
+
+import random
+
+import pytest
+
+from floppytools.base import chsset
+
+class ListCHSSet():
+    ''' The list based CHSSet, which kept every (c, h, s, payload) '''
+
+    def __init__(self):
+        self.chs = []
+
+    def add(self, chs, payload=0):
+        self.chs.append((*chs, payload))
+
+    def cluster(self):
+        wl = list(chsset.Cluster(x) for x in sorted(self.chs))
+        for pivot in (2, 1, 0):
+            i = 0
+            while i < len(wl) - 1:
+                if wl[i].same(wl[i+1], pivot):
+                    wl[i].merge(wl[i+1])
+                    wl.pop(i+1)
+                else:
+                    i += 1
+        return wl
+
+    def cuboids(self):
+        cl = list(self.cluster())
+        i = 0
+        while i < len(cl) - 1:
+            if cl[i].b != cl[i+1].b:
+                i += 1
+            else:
+                cl[i].merge(cl.pop(i+1))
+        return cl
+
+    def __iter__(self):
+        wl = []
+        for c, h, s, p in sorted(self.chs):
+            if wl:
+                prev = wl[-1]
+                if prev[0] == set((c,)) and prev[1] == set((h,)):
+                    prev[2].add(s)
+                    prev[3].add(p)
+                    continue
+            wl.append([set((c,)), set((h,)), set((s,)), set((p,))])
+        i = 0
+        while i < len(wl) - 1:
+            if wl[i][0] == wl[i+1][0] and wl[i][2] == wl[i+1][2]:
+                wl[i][1] |= wl[i+1][1]
+                wl.pop(i+1)
+            else:
+                i += 1
+        while wl:
+            c, h, s, p = wl.pop(0)
+            i = 0
+            while i < len(wl):
+                if wl[i][1] == h and wl[i][2] == s:
+                    c |= wl[i][0]
+                    wl.pop(i)
+                else:
+                    i += 1
+            yield "c" + chsset.summarize_ints(c) + "h" + chsset.summarize_ints(h) + \
+                "s" + chsset.summarize_ints(s) + "b" + chsset.summarize_ints(p)
+
+def random_sets(seed):
+    ''' The same random sectors in a CHSSet and a ListCHSSet '''
+    rng = random.Random(seed)
+    new = chsset.CHSSet()
+    old = ListCHSSet()
+    ncyl = rng.randrange(1, 80)
+    nhead = rng.randrange(1, 3)
+    nsec = rng.randrange(1, 30)
+    payloads = rng.choice(((0,), (256,), (128, 256), (0, 128, 256, 512)))
+    holes = rng.random() * .3
+    for c in range(ncyl):
+        for h in range(nhead):
+            for s in range(nsec):
+                if rng.random() < holes:
+                    continue
+                payload = rng.choice(payloads)
+                new.add((c, h, s), payload)
+                old.add((c, h, s), payload)
+    return new, old
+
+def clusters(lst):
+    return [(x.c, x.h, x.s, x.b, x.n) for x in lst]
+
+@pytest.mark.parametrize("seed", range(50))
+def test_same_as_list_based(seed):
+    new, old = random_sets(seed)
+    assert len(new) == len(old.chs)
+    assert list(new) == list(old)
+    assert clusters(new.cluster()) == clusters(old.cluster())
+    assert clusters(new.cuboids()) == clusters(old.cuboids())
+
+def test_summary():
+    cs = chsset.CHSSet()
+    for c in range(5):
+        for h in range(2):
+            for s in range(8):
+                if h + s != 4:
+                    cs.add((c, h, s))
+    assert len(cs) == 70
+    assert list(cs) == ["c{0-4}h{0}s{0-3,5-7}b{0}", "c{0-4}h{1}s{0-2,4-7}b{0}"]
+    assert cs.cylinders() == "c{0-4}"
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+
+'''
+   Tests of the flux stream base class
+   ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+'''
+
+import time
+
+import pytest
+
+from floppytools.base import fluxstream
+
+class ListStream(fluxstream.FluxStream):
+    ''' A stream of intervals from a list '''
+
+    def __init__(self, dts):
+        super().__init__()
+        self.dts = dts
+
+    def iter_dt(self):
+        yield from self.dts
+
+def test_clock_recovery_checks_budget():
+    stream = ListStream([50, 75, 100] * 1000)
+    stream.deadline = time.thread_time() - 1
+    with pytest.raises(fluxstream.OutOfTime):
+        stream.mfm_flux()
+    stream.deadline = None
+    assert stream.mfm_flux().startswith("-|--|---|")
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+'''
+   Tests of the IBM format decoding
+   ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+'''
+
+import pytest
+
+pytest.importorskip("crcmod")
+
+from floppytools.base import fluxstream
+from floppytools.base import checks
+from floppytools.formats import ibm
+
+def mfm(octets, prev=0):
+    ''' MFM encode octets as a flux string '''
+    out = []
+    for octet in octets:
+        for i in range(7, -1, -1):
+            bit = (octet >> i) & 1
+            out.append('|' if not bit and not prev else '-')
+            out.append('|' if bit else '-')
+            prev = bit
+    return ''.join(out)
+
+def mfm_sector(chs, data):
+    ''' Flux of one MFM sector, address mark, gap and data field '''
+    track = ibm.IbmMfmTrack
+    am = bytes([0xa1] * 3 + [0xfe, chs[0], chs[1], chs[2], 1])
+    am += checks.crc16_ccitt_false(am).to_bytes(2, 'big')
+    field = bytes([0xa1] * 3 + [0xfb]) + data
+    field += checks.crc16_ccitt_false(field).to_bytes(2, 'big')
+    return (
+        track.AM_PATTERN + mfm(am[4:]) + mfm(b'\x4e' * 22) +
+        track.DATA_PATTERN + mfm(field[4:]) + mfm(b'\x4e' * 40)
+    )
+
+class FluxTrack(fluxstream.FluxStream):
+    ''' A stream with a ready made MFM flux string '''
+
+    def __init__(self, chs, flux, name):
+        super().__init__()
+        self.chs = chs
+        self.flux = flux
+        self.name = name
+
+    def serialize(self):
+        return self.name
+
+    def mfm_flux(self, rate=50):
+        return self.flux
+
+def payload(head, sec):
+    return bytes([head, sec]) * 128
+
+def track(head, am_head):
+    return '|-' * 1000 + ''.join(
+        mfm_sector((5, am_head, sec), payload(head, sec)) for sec in range(1, 10)
+    )
+
+def test_settled_by_physical_head():
+    ''' Single sided address marks, written on both sides '''
+    media = ibm.Ibm(None)
+    for n in range(media.SETTLED_READINGS):
+        media.process_stream(FluxTrack((5, 0, 0), track(0, 0), "h0.%d" % n))
+    assert all(media.sector_settled((5, 0, sec)) for sec in range(1, 10))
+    media.process_stream(FluxTrack((5, 1, 0), track(1, 0), "h1"))
+    for sec in range(1, 10):
+        ms = media.sectors[(5, 1, sec)]
+        assert ms.am_chs == (5, 0, sec)
+        assert ms.find_majority() == payload(1, sec)
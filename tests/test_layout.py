@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+'''
+   Tests of the track layout learning and prediction
+   ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+'''
+
+from floppytools.base import layout
+
+PITCH = 1000
+NSLOTS = 10
+
+# Interleave 2
+ORDER = [1, 6, 2, 7, 3, 8, 4, 9, 5, 10]
+
+def positions(start, revolutions):
+    ''' (rel_pos, sector) of every sector, from start '''
+    return [
+        (start + (rev * NSLOTS + slot) * PITCH, sec)
+        for rev in range(revolutions)
+        for slot, sec in enumerate(ORDER)
+    ]
+
+def learned_layout():
+    track = layout.TrackLayout()
+    for source, start in (("a", 500), ("b", 3700)):
+        for rel_pos, sec in positions(start, 2):
+            track.add(source, rel_pos, sec)
+    return track
+
+def test_learn():
+    pitch, rev, nslots, slots = learned_layout().learn()
+    assert (pitch, rev, nslots) == (PITCH, PITCH * NSLOTS, NSLOTS)
+    assert slots == {sec: slot for slot, sec in enumerate(ORDER)}
+
+def test_too_little_to_learn():
+    track = layout.TrackLayout()
+    track.add("a", 100, 1)
+    assert track.learn() is None
+    assert not list(track.predict([(100, 1)], 10000))
+
+def test_predict_missing():
+    missing = (7, 3)
+    stream = positions(300, 2)
+    anchors = [x for x in stream if x[1] not in missing]
+    predicted = list(learned_layout().predict(anchors, 300 + 2 * NSLOTS * PITCH))
+    assert sorted((pos, sec) for pos, sec, _slack in predicted) == sorted(
+        x for x in stream if x[1] in missing
+    )
+    assert set(slack for _pos, _sec, slack in predicted) == {PITCH // 8}
+
+def test_predict_within_limit():
+    stream = positions(300, 1)
+    anchors = [x for x in stream if x[1] != 10]
+    # Sector 10 is in the last slot, at the limit
+    assert not list(learned_layout().predict(anchors, stream[-1][0]))
+    assert list(learned_layout().predict(anchors, stream[-1][0] + 1)) == [
+        (stream[-1][0], 10, PITCH // 8)
+    ]
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+
+'''
+   Tests of the log file writer
+   ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+'''
+
+from floppytools.base import log
+
+def test_unwritable_file(tmp_path, capsys):
+    manager = log.LogManager()
+    bad = manager.open(str(tmp_path / "missing" / "bad.trace"))
+    good = manager.open(str(tmp_path / "good.trace"))
+    for i in range(3):
+        manager.write(bad, "bad %d\n" % i)
+        manager.write(good, "good %d\n" % i)
+        manager.flush()
+    manager.close(bad)
+    manager.close(good)
+    manager.shutdown()
+    assert (tmp_path / "good.trace").read_text() == "good 0\ngood 1\ngood 2\n"
+    assert capsys.readouterr().err.count("Cannot write log file") == 1
+
+def test_rotation(tmp_path):
+    manager = log.LogManager(max_size=10, keep=2)
+    fn = manager.open(str(tmp_path / "x.trace"))
+    for i in range(4):
+        manager.write(fn, "line %d\n" % i)
+        manager.flush()
+    manager.close(fn)
+    manager.shutdown()
+    assert (tmp_path / "x.trace.1").read_text() == "line 2\nline 3\n"
+    assert (tmp_path / "x.trace.2").read_text() == "line 0\nline 1\n"
+    assert not (tmp_path / "x.trace").exists()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+'''
+   Tests of the pool of live media
+   ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+'''
+
+import os
+
+import pytest
+
+pytest.importorskip("crcmod")
+
+from floppytools import main
+from floppytools.base import media
+
+class Blank(media.Media):
+    ''' A format with a geometry, which never finds anything '''
+
+    GEOMETRY = ((0, 0, 0), (1, 0, 3), 16)
+
+    def process_stream(self, stream):
+        return False
+
+def bare_main():
+    ''' A Main, without parsing sys.argv and running '''
+    retval = main.Main.__new__(main.Main)
+    retval.pool = {}
+    retval.defects = {}
+    retval.screen = None
+    return retval
+
+def test_pool_eviction(tmp_path):
+    mn = bare_main()
+    dirs = [str(tmp_path / ("m%d" % i)) for i in range(main.POOL_SIZE + 2)]
+    media_dirs = [Blank(x) for x in dirs]
+    for mdir in media_dirs[:main.POOL_SIZE]:
+        mn.pool_media(mdir)
+    # Using the first again makes the second the least recently used
+    mn.pool_media(media_dirs[0])
+    for mdir in media_dirs[main.POOL_SIZE:]:
+        mn.pool_media(mdir)
+
+    evicted = [media_dirs[1], media_dirs[2]]
+    for mdir in media_dirs:
+        status = os.path.exists(mdir.file_name(".status"))
+        assert status == (mdir in evicted)
+        assert (mn.pooled_media(mdir.dirname) is mdir) == (mdir not in evicted)
+        assert bool(mdir.log_files) == (mdir not in evicted)
+    assert len(mn.pool) == main.POOL_SIZE
+    with open(media_dirs[1].file_name(".status"), encoding="utf8") as file:
+        assert file.readline() == "Dirname m1\n"
+
+def test_drop_media(tmp_path):
+    mn = bare_main()
+    mdir = Blank(str(tmp_path / "m"))
+    mn.pool_media(mdir)
+    mn.drop_media(mdir)
+    assert mn.pooled_media(mdir.dirname) is None
+    assert not mdir.log_files
+
+def test_close_media(tmp_path):
+    mn = bare_main()
+    media_dirs = [Blank(str(tmp_path / ("m%d" % i))) for i in range(2)]
+    for mdir in media_dirs:
+        mn.pool_media(mdir)
+    mn.close_media()
+    assert not mn.pool
+    for mdir in media_dirs:
+        assert os.path.exists(mdir.file_name(".status"))
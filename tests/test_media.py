@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+'''
+   Tests of the format probing
+   ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+'''
+
+import os
+
+import pytest
+
+pytest.importorskip("crcmod")
+
+from floppytools.base import fluxstream
+from floppytools.base import media
+
+class TrackStream(fluxstream.FluxStream):
+    ''' A stream of the given sector numbers of cylinder 1 '''
+
+    def __init__(self, sectors):
+        super().__init__()
+        self.chs = (1, 0, 0)
+        self.sectors = sectors
+
+    def serialize(self):
+        return "track.raw"
+
+class Found(media.Media):
+    ''' Reads whichever sectors the stream has, without expectations '''
+
+    def process_stream(self, stream):
+        for sec in stream.sectors:
+            self.did_read_sector(stream, sec, (1, 0, sec), bytes(16))
+        return True
+
+class Expected(Found):
+    ''' Like Found, but knows there are 16 sectors per track '''
+
+    GEOMETRY = ((0, 0, 0), (9, 0, 15), 16)
+
+def test_probe_all_expected_sectors():
+    assert Expected.probe(TrackStream(range(16))) == 1
+
+def test_probe_geometry_wins_tie():
+    stream = TrackStream(range(15))
+    assert Expected.probe(stream) > Found.probe(stream) > 0
+
+def test_probe_more_sectors_win():
+    assert Found.probe(TrackStream(range(16))) > Expected.probe(TrackStream(range(8)))
+
+def test_probe_creates_no_files(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    Expected.probe(TrackStream(range(16)))
+    assert not os.listdir(tmp_path)
+
+def test_marker_file_name_with_spaces(tmp_path):
+    media_dir = Expected(str(tmp_path))
+    media_dir.write_marker("side a/track 00.0.raw")
+    media_dir.close()
+    assert media.read_marker(str(tmp_path)) == ("Expected", 1, "side a/track 00.0.raw")
+
+@pytest.mark.parametrize("text", ["", "format Ibm", "format Ibm x a.raw\n", "\xff\xfe"])
+def test_marker_corrupt(tmp_path, text):
+    with open(tmp_path / media.MARKER_FILE, "w", encoding="latin1") as file:
+        file.write(text)
+    assert media.read_marker(str(tmp_path)) is None
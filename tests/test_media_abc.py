@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+'''
+   Tests of the sector consensus
+   ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+'''
+
+from floppytools.base import media_abc
+
+A = bytes(range(16))
+B = bytes(range(1, 17))
+
+def media_sector(*readings):
+    ''' A MediaSector with the given (octets, flags) readings '''
+    ms = media_abc.MediaSector((1, 0, 1), (1, 0, 1), len(A))
+    for n, (octets, flags) in enumerate(readings):
+        ms.add_read_sector(
+            media_abc.ReadSector("s%d" % n, n, (1, 0, 1), octets, flags, phys_chs=(1, 0, 1))
+        )
+    return ms
+
+def test_majority_two_to_one():
+    ms = media_sector((A, ()), (B, ()), (A, ()))
+    assert ms.find_majority() == A
+
+def test_majority_three_to_two():
+    ms = media_sector((A, ()), (B, ()), (A, ()), (B, ()), (A, ()))
+    assert ms.find_majority() == A
+
+def test_majority_five_to_three():
+    ms = media_sector(*([(A, ())] * 5 + [(B, ())] * 3))
+    assert ms.find_majority() == A
+
+def test_no_majority_one_to_one():
+    ms = media_sector((A, ()), (B, ()))
+    assert ms.find_majority() is None
+
+def test_repaired_alone_is_no_majority():
+    ms = media_sector((A, ("repaired",)))
+    assert ms.find_majority() is None
+    ms = media_sector((A, ("repaired",)), (A, ("repaired",)))
+    assert ms.find_majority() == A
+
+def test_summary_counts_good_sectors():
+    media = media_abc.MediaAbc("test")
+    for s in range(1, 5):
+        media.define_sector((1, 0, s), len(A))
+    for s in (1, 2):
+        media.add_read_sector(
+            media_abc.ReadSector("src", s, (1, 0, s), A, phys_chs=(1, 0, s))
+        )
+    assert media.summary().split() == ["test", "✓:", "2"]
+    assert len(media.good_set()) == 2
+    for s in (3, 4):
+        media.add_read_sector(
+            media_abc.ReadSector("src", s, (1, 0, s), A, phys_chs=(1, 0, s))
+        )
+    assert media.summary().split() == ["test", "COMPLETE"]
+    assert len(media.good_set()) == 4
+
+def test_predicted_does_not_outvote():
+    p = ("predicted",)
+    ms = media_sector((B, p), (B, p), (A, ()), (A, ()))
+    assert ms.find_majority() == A
+    ms = media_sector((B, ("predicted",)))
+    assert ms.find_majority() is None
+
+def test_interns_are_per_media():
+    one = media_abc.MediaAbc("one")
+    two = media_abc.MediaAbc("two")
+    one.add_read_sector(media_abc.ReadSector("a.raw", 7, (1, 0, 1), A, ("x",), phys_chs=(1, 0, 1)))
+    two.add_read_sector(media_abc.ReadSector("b.raw", 9, (1, 0, 1), B, phys_chs=(1, 0, 1)))
+    assert one.interns.sources == ["a.raw"]
+    assert two.interns.sources == ["b.raw"]
+    rs = one.sectors[(1, 0, 1)].readings[0]
+    assert (rs.source, rs.rel_pos, rs.octets, rs.flags) == ("a.raw", 7, A, frozenset(("x",)))
+
+def test_readings_in_arrival_order():
+    ms = media_sector((A, ()), (B, ()), (A, ()), (B, ("x",)))
+    assert [(rs.source, rs.octets) for rs in ms.readings] == [
+        ("s0", A), ("s1", B), ("s2", A), ("s3", B)
+    ]
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+'''
+   Tests of the Q1 MicroLite clock detection
+   ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+'''
+
+import random
+
+import pytest
+
+pytest.importorskip("crcmod")
+
+from floppytools.base import fluxstream
+from floppytools.formats import q1_microlite
+
+class ListStream(fluxstream.FluxStream):
+    ''' A stream of intervals from a list '''
+
+    def __init__(self, dts):
+        super().__init__()
+        self.dts = dts
+        self.chs = (1, 0, 0)
+
+    def iter_dt(self):
+        for dt in self.dts:
+            self.histo[min(dt // self.histo_scale, len(self.histo) - 1)] += 1
+            yield dt
+
+def mfm_intervals(clock, weights, seed=1):
+    ''' Jittered 2T, 3T and 4T intervals '''
+    rng = random.Random(seed)
+    return [
+        int(rng.choices((2, 3, 4), weights)[0] * clock + rng.gauss(0, 2))
+        for _i in range(20000)
+    ]
+
+@pytest.mark.parametrize("clock", q1_microlite.Q1MicroLiteMFM28.CLOCKS)
+def test_detect_clock(clock):
+    media = q1_microlite.Q1MicroLiteMFM28(None)
+    assert media.detect_clock(ListStream(mfm_intervals(clock, (5, 3, 2)))) == clock
+
+@pytest.mark.parametrize("weights", [(2, 5, 3), (1, 1, 1), (1, 2, 5)])
+@pytest.mark.parametrize("clock", q1_microlite.Q1MicroLiteMFM28.CLOCKS)
+def test_detect_clock_never_wrong(clock, weights):
+    ''' If the peak is not 2T, the clock may be in doubt, but never wrong '''
+    media = q1_microlite.Q1MicroLiteMFM28(None)
+    assert media.detect_clock(ListStream(mfm_intervals(clock, weights))) in (clock, None)
+
+def test_detect_clock_in_doubt():
+    media = q1_microlite.Q1MicroLiteMFM28(None)
+    assert media.detect_clock(ListStream([67] * 1000)) is None
+    assert media.detect_clock(ListStream([])) is None
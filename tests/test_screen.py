@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+'''
+   Tests of the terminal output
+   ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+'''
+
+import io
+
+from floppytools import screen
+from floppytools.screen import ESC_HOME, ESC_EOL, ESC_EOS, esc_goto
+
+def painted(lines):
+    ''' A Screen which has shown lines, and an empty output '''
+    file = io.StringIO()
+    scr = screen.Screen(file, max_rate=1000)
+    scr.show(lines)
+    assert file.getvalue() == ESC_HOME + "".join(
+        x + ESC_EOL + "\n" for x in lines
+    ) + ESC_EOS
+    file.seek(0)
+    file.truncate()
+    return scr, file
+
+def test_unchanged():
+    scr, file = painted(["abc", "def"])
+    scr.show(["abc", "def"])
+    assert file.getvalue() == esc_goto(2, 0)
+
+def test_changed_character():
+    scr, file = painted(["abc", "defgh"])
+    scr.show(["abc", "deXgh"])
+    assert file.getvalue() == esc_goto(1, 2) + "X" + esc_goto(2, 0)
+
+def test_changed_span():
+    scr, file = painted(["abcdefgh"])
+    scr.show(["abXdeYgh"])
+    assert file.getvalue() == esc_goto(0, 2) + "XdeY" + esc_goto(1, 0)
+
+def test_changed_length():
+    scr, file = painted(["abcdef", "x"])
+    scr.show(["abc", "xyz"])
+    assert file.getvalue() == (
+        esc_goto(0, 3) + ESC_EOL +
+        esc_goto(1, 1) + "yz" + ESC_EOL +
+        esc_goto(2, 0)
+    )
+
+def test_more_lines():
+    scr, file = painted(["abc"])
+    scr.show(["abc", "def"])
+    assert file.getvalue() == esc_goto(1, 0) + "def" + ESC_EOL + esc_goto(2, 0)
+
+def test_fewer_lines():
+    scr, file = painted(["abc", "def", "ghi"])
+    scr.show(["abc"])
+    assert file.getvalue() == esc_goto(1, 0) + ESC_EOS + esc_goto(1, 0)
+
+def test_invalidate():
+    scr, file = painted(["abc"])
+    scr.invalidate()
+    scr.show(["abc"])
+    assert file.getvalue() == ESC_HOME + "abc" + ESC_EOL + "\n" + ESC_EOS
+
+def test_rate_limit():
+    scr, file = painted(["abc"])
+    scr.interval = 3600
+    scr.update(lambda: ["xyz"])
+    assert file.getvalue() == ""
+    scr.flush()
+    assert file.getvalue() == esc_goto(0, 0) + "xyz" + esc_goto(1, 0)